@@ -48,6 +48,7 @@ setup(
     entry_points={
         "console_scripts": [
             "onlyfiles=onlyfiles.main:main",
+            "onlyfiles-bench=onlyfiles.benchmark:main",
         ],
     },
 ) 
\ No newline at end of file
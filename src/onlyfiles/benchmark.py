@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the OnlyFiles operations.
+Every operation runs against a fresh synthetic directory tree generated from a
+seed, so two runs with the same options see exactly the same files and their
+JSON results can be compared between versions.
+
+Usage example:
+    python -m onlyfiles.benchmark --files 5000 --depth 2 --unicode 0.2 --output before.json
+    python -m onlyfiles.benchmark --files 5000 --depth 2 --unicode 0.2 --baseline before.json
+"""
+
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from onlyfiles.utils.logger import Logger
+from onlyfiles.core.file_manager import FileManager
+from onlyfiles.core.execution import Execution
+from onlyfiles.core.file_types import file_types
+from onlyfiles.core.journal import Journal
+from onlyfiles.core.hash_cache import HashCache
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+console = Console()
+
+# Size distributions of the generated files: (min bytes, max bytes, weight) ranges
+SIZE_DISTRIBUTIONS = {
+    'small': ((0, 4 * 1024, 70), (4 * 1024, 64 * 1024, 30)),
+    'mixed': ((0, 4 * 1024, 40), (4 * 1024, 256 * 1024, 40), (256 * 1024, 4 * 1024 ** 2, 15),
+              (4 * 1024 ** 2, 32 * 1024 ** 2, 5)),
+    'large': ((1024 ** 2, 16 * 1024 ** 2, 60), (16 * 1024 ** 2, 128 * 1024 ** 2, 40)),
+}
+
+# Extension mixes of the generated files, extension -> weight ('' is no extension)
+EXTENSION_MIXES = {
+    'mixed': dict([(extension, 1) for extensions in file_types.values() for extension in extensions]
+                  + [('.bin', 2), ('.xyz', 1), ('', 1)]),
+    'media': {'.jpg': 10, '.png': 3, '.heic': 2, '.mp4': 3, '.mov': 1, '.mp3': 4, '.flac': 1},
+    'documents': {'.pdf': 6, '.docx': 3, '.xlsx': 2, '.txt': 4, '.md': 2, '.odt': 1, '.csv': 2},
+}
+
+# Name parts of the generated files, unicode names mix scripts, accents and emoji
+ASCII_WORDS = ('report', 'photo', 'track', 'draft', 'invoice', 'notes', 'scan', 'clip', 'data', 'final')
+UNICODE_WORDS = ('relatório', 'café', 'naïve', 'straße', 'документ', 'фото', '文件', '写真', 'ファイル', '사진', 'música',
+                 '📷', '🎵', 'ação')
+
+# Start of the modification time range of the generated files, fixed so date folders are reproducible
+MTIME_BASE = 1700000000
+MTIME_SPAN_DAYS = 365
+
+# Bytes of pseudo-random content the files are cut from
+CONTENT_BLOCK_SIZE = 1024 ** 2
+
+# Audit events counted as file system calls, see the audit events table of the Python documentation
+AUDITED_EVENTS = frozenset({'open', 'os.scandir', 'os.listdir', 'os.rename', 'os.mkdir', 'os.link', 'os.symlink',
+                            'os.remove', 'os.rmdir', 'os.utime', 'os.chmod', 'os.truncate', 'shutil.copyfile'})
+
+# Benchmarked operations, in the order they run
+OPERATIONS = ('organize_by_extension', 'organize_by_date', 'organize_by_size', 'organize_by_type', 'organize_all',
+              'create_backup', 'create_backup_store', 'revert_backup', 'revert_last_action')
+
+
+class TreeSpec(namedtuple('TreeSpec', ['files', 'depth', 'fanout', 'sizes', 'extensions', 'unicode_ratio', 'seed'])):
+    """Synthetic tree settings, sizes names a SIZE_DISTRIBUTIONS entry and extensions an EXTENSION_MIXES entry or "jpg=5,pdf=1" weights"""
+
+    __slots__ = ()
+
+
+class TreeStats(namedtuple('TreeStats', ['files', 'bytes', 'directories'])):
+    """Totals of a generated tree"""
+
+    __slots__ = ()
+
+
+def parse_extensions(value):
+    """Return the extension weights of a mix name or of "jpg=5,pdf=1" weights"""
+    if value in EXTENSION_MIXES:
+        return EXTENSION_MIXES[value]
+    weights = {}
+    for item in value.split(','):
+        extension, _, weight = item.strip().partition('=')
+        extension = extension.strip().lstrip('.')
+        try:
+            weights['.' + extension if extension else ''] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid extension weight: {item}")
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError(f"Invalid extension mix: {value}")
+    return weights
+
+
+def generate_tree(root, spec):
+    """
+    Generate a reproducible directory tree of files.
+
+    Parameters:
+    root (str): Directory the tree is created in, created if missing
+    spec (TreeSpec): Tree settings, the same spec always gives the same names, sizes, contents and times
+
+    Returns:
+    TreeStats: Number of files, bytes and directories generated
+    """
+    rng = random.Random(spec.seed)
+    sizes = SIZE_DISTRIBUTIONS[spec.sizes]
+    extensions = parse_extensions(spec.extensions)
+    extension_list, extension_weights = list(extensions), list(extensions.values())
+    block = rng.getrandbits(CONTENT_BLOCK_SIZE * 8).to_bytes(CONTENT_BLOCK_SIZE, 'little')
+
+    # Folders level by level, each folder above the last level has fanout subfolders
+    directories = [root]
+    level = [root]
+    for depth in range(spec.depth):
+        level = [os.path.join(parent, f'dir{depth}_{index}') for parent in level for index in range(spec.fanout)]
+        directories.extend(level)
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    total = 0
+    for index in range(spec.files):
+        low, high, _ = rng.choices(sizes, weights=[weight for _, _, weight in sizes])[0]
+        size = rng.randint(low, high)
+        words = UNICODE_WORDS if rng.random() < spec.unicode_ratio else ASCII_WORDS
+        extension = rng.choices(extension_list, weights=extension_weights)[0]
+        path = os.path.join(rng.choice(directories), f'{rng.choice(words)}_{index}{extension}')
+
+        # Each file starts with its index, contents never collide
+        header = f'{index}\n'.encode()
+        offset = rng.randrange(CONTENT_BLOCK_SIZE)
+        with open(path, 'wb') as f:
+            f.write(header[:size])
+            remaining = size - len(header[:size])
+            while remaining > 0:
+                chunk = block[offset:offset + remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        mtime = MTIME_BASE - rng.randrange(MTIME_SPAN_DAYS * 86400)
+        os.utime(path, (mtime, mtime))
+        total += size
+    return TreeStats(spec.files, total, len(directories))
+
+
+class SyscallCounter:
+    """
+    Counts of the file system calls made while enabled, from every thread.
+
+    Python calls are counted through audit hooks, which can't be removed, so a
+    single counter is installed per process (see syscall_counter). The read and
+    write system calls of the whole process come from /proc/self/io on Linux.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counts = Counter()
+        self.__io_start = Counter()
+        self.enabled = False
+        sys.addaudithook(self.__hook)
+
+    def __hook(self, event, args):
+        """Private method to count an audited call"""
+        if self.enabled and event in AUDITED_EVENTS:
+            with self.__lock:
+                self.__counts[event] += 1
+
+    @staticmethod
+    def __io_counters():
+        """Private method to return the read and write system calls of the process, empty if unknown"""
+        try:
+            with open('/proc/self/io', 'r') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            return Counter({'read': int(fields['syscr']), 'write': int(fields['syscw'])})
+        except (OSError, KeyError, ValueError):
+            return Counter()
+
+    def start(self):
+        """Reset the counts and start counting"""
+        with self.__lock:
+            self.__counts.clear()
+        self.__io_start = self.__io_counters()
+        self.enabled = True
+
+    def stop(self):
+        """Stop counting and return the counts by call name"""
+        self.enabled = False
+        counts = Counter(self.__counts)
+        io = self.__io_counters()
+        for call, count in io.items():
+            counts[call] = count - self.__io_start.get(call, 0)
+        return dict(sorted(counts.items()))
+
+
+_syscall_counter = None
+
+
+def syscall_counter():
+    """Return the process-wide SyscallCounter"""
+    global _syscall_counter
+    if _syscall_counter is None:
+        _syscall_counter = SyscallCounter()
+    return _syscall_counter
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the process, return False where it can't be reset"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes, None if unknown"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Benchmark:
+    """
+    Runs the OnlyFiles operations against synthetic trees and measures them.
+
+    Usage example:
+        benchmark = Benchmark(TreeSpec(1000, 2, 3, 'small', 'mixed', 0.1, 42), workdir='/tmp')
+        result = benchmark.run('organize_by_type')
+        benchmark.close()
+    """
+
+    def __init__(self, spec, workdir=None, max_workers=DEFAULT_WORKERS, summary=False):
+        self.spec = spec
+        self.__max_workers = max_workers
+        self.__summary = summary
+        self.workdir = tempfile.mkdtemp(prefix='onlyfiles-bench-', dir=workdir)
+        self.__log_file = Logger.LOG_FILE
+        self.__logger = self.__open_logger()
+        self.__journal = Journal(os.path.join(self.workdir, 'journal.jsonl'))
+        self.__hash_cache = HashCache(os.path.join(self.workdir, 'hashes.db'))
+
+    def __open_logger(self):
+        """Private method to log into the work directory, showing only warnings and errors on the console"""
+        Logger.LOG_FILE = os.path.join(self.workdir, 'benchmark.log')
+        logger = Logger('onlyfiles.benchmark')
+        for handler in logger.logger.handlers:
+            if not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.WARNING)
+        return logger
+
+    def __file_manager(self):
+        """Private method to create the FileManager of a run"""
+        return FileManager(self.__logger, self.__max_workers, journal=self.__journal, summary=self.__summary,
+                           hash_cache=self.__hash_cache)
+
+    def __prepare(self, operation, root):
+        """Private method to bring a fresh tree into the state an operation starts from, return the FileManager to run it with"""
+        file_manager = self.__file_manager()
+        recursive = self.spec.depth > 0
+        if operation == 'revert_backup':
+            # Every file is moved away after the backup, the revert restores all of them
+            file_manager.create_backup(root)
+            file_manager.organize_by_type(root, recursive)
+        elif operation == 'revert_last_action':
+            file_manager.organize_by_type(root, recursive)
+        return file_manager
+
+    def __execute(self, operation, file_manager, root):
+        """Private method to run an operation, return whether it succeeded"""
+        recursive = self.spec.depth > 0
+        if operation == 'organize_all':
+            execution = Execution(self.__logger, self.__max_workers, summary=self.__summary, journal=self.__journal)
+            return execution.organize_all(root, recursive)
+        if operation == 'create_backup':
+            return file_manager.create_backup(root) is not None
+        if operation == 'create_backup_store':
+            return file_manager.create_backup(root, 'store') is not None
+        if operation == 'revert_backup':
+            return file_manager.revert_backup(root, delete_extra=True)
+        if operation == 'revert_last_action':
+            return file_manager.revert_last_action()
+        return bool(getattr(file_manager, operation)(root, recursive))
+
+    def run(self, operation):
+        """
+        Run an operation against a fresh tree.
+
+        Parameters:
+        operation (str): One of OPERATIONS
+
+        Returns:
+        dict: Operation, tree totals, seconds, files/s, bytes/s, file system calls and peak RSS
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+        root = os.path.join(self.workdir, 'tree')
+        shutil.rmtree(root, ignore_errors=True)
+        tree = generate_tree(root, self.spec)
+        try:
+            file_manager = self.__prepare(operation, root)
+            counter = syscall_counter()
+            rss_reset = reset_peak_rss()
+            counter.start()
+            start = time.perf_counter()
+            try:
+                success = self.__execute(operation, file_manager, root)
+            finally:
+                seconds = time.perf_counter() - start
+                syscalls = counter.stop()
+            elapsed = max(seconds, 1e-9)
+            return {
+                'operation': operation,
+                'success': bool(success),
+                'files': tree.files,
+                'bytes': tree.bytes,
+                'seconds': seconds,
+                'files_per_sec': tree.files / elapsed,
+                'bytes_per_sec': tree.bytes / elapsed,
+                'syscalls': syscalls,
+                'peak_rss_bytes': peak_rss(),
+                # Without a reset the peak covers the whole process, not only this operation
+                'peak_rss_reset': rss_reset,
+            }
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def close(self):
+        """Remove the work directory"""
+        Logger.LOG_FILE = self.__log_file
+        self.__hash_cache.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_benchmarks(spec, operations=OPERATIONS, repeat=1, workdir=None, max_workers=DEFAULT_WORKERS, summary=False):
+    """
+    Run operations against synthetic trees.
+
+    Each operation runs repeat times, the run with the median time is reported.
+
+    Returns:
+    dict: Environment, tree settings and the result of each operation, ready to be saved as JSON
+    """
+    benchmark = Benchmark(spec, workdir, max_workers, summary)
+    try:
+        results = []
+        for operation in operations:
+            runs = sorted((benchmark.run(operation) for _ in range(repeat)), key=lambda run: run['seconds'])
+            result = runs[(len(runs) - 1) // 2]
+            result['runs'] = [run['seconds'] for run in runs]
+            result['stdev'] = statistics.stdev(result['runs']) if len(runs) > 1 else 0.0
+            results.append(result)
+    finally:
+        benchmark.close()
+    return {
+        'version': _version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'workers': max_workers,
+        'summary': summary,
+        'tree': spec._asdict(),
+        'results': results,
+    }
+
+
+def _version():
+    """Return the installed OnlyFiles version, 'unknown' when running from a source tree"""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version('onlyfiles')
+        except PackageNotFoundError:
+            return 'unknown'
+    except ImportError:
+        return 'unknown'
+
+
+def _format_bytes(size):
+    """Return a size in human-readable units"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def _show_results(report, baseline=None):
+    """Print the results as a table, with the change of files/s from a baseline report"""
+    previous = {result['operation']: result for result in baseline['results']} if baseline else {}
+    table = Table(show_header=True, header_style="bold magenta", title=f"{report['tree']['files']} files, seed {report['tree']['seed']}")
+    table.add_column("Operation")
+    table.add_column("Time", justify="right")
+    table.add_column("Files/s", justify="right")
+    table.add_column("Bytes/s", justify="right")
+    table.add_column("FS calls", justify="right")
+    table.add_column("Peak RSS", justify="right")
+    if previous:
+        table.add_column("vs baseline", justify="right")
+
+    for result in report['results']:
+        status = "" if result['success'] else " [red](failed)[/red]"
+        row = [result['operation'] + status, f"{result['seconds']:.3f}s", f"{result['files_per_sec']:.0f}",
+               f"{_format_bytes(result['bytes_per_sec'])}/s", str(sum(result['syscalls'].values())),
+               _format_bytes(result['peak_rss_bytes']) if result['peak_rss_bytes'] is not None else "-"]
+        if previous:
+            old = previous.get(result['operation'])
+            if old and old['files_per_sec']:
+                change = (result['files_per_sec'] / old['files_per_sec'] - 1) * 100
+                row.append(f"[{'green' if change >= 0 else 'red'}]{change:+.1f}%[/]")
+            else:
+                row.append("-")
+        table.add_row(*row)
+    console.print(table)
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('--files', '-n', type=click.IntRange(min=1), default=1000, help='Number of files of the tree')
+@click.option('--depth', type=click.IntRange(min=0), default=2, help='Levels of subfolders')
+@click.option('--fanout', type=click.IntRange(min=1), default=3, help='Subfolders of each folder')
+@click.option('--sizes', type=click.Choice(list(SIZE_DISTRIBUTIONS)), default='small', help='File size distribution')
+@click.option('--extensions', default='mixed', help=f'Extension mix ({", ".join(EXTENSION_MIXES)}) or weights such as "jpg=5,pdf=1"')
+@click.option('--unicode', 'unicode_ratio', type=click.FloatRange(0, 1), default=0.1, help='Share of files with unicode names')
+@click.option('--seed', type=int, default=42, help='Seed of the generated tree')
+@click.option('--operation', '-o', 'operations', type=click.Choice(OPERATIONS), multiple=True,
+              help='Operation to run, can be repeated (default: all)')
+@click.option('--repeat', type=click.IntRange(min=1), default=1, help='Runs of each operation, the median is reported')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=DEFAULT_WORKERS, help='Number of concurrent file moves')
+@click.option('--summary', is_flag=True, help='Log per-category totals instead of every moved file')
+@click.option('--workdir', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Folder the trees are generated in (default: the system temporary folder)')
+@click.option('--output', type=click.Path(dir_okay=False), default='benchmark.json', help='JSON file of the results')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='JSON results of an earlier run to compare with')
+def benchmark(files, depth, fanout, sizes, extensions, unicode_ratio, seed, operations, repeat, workers, summary,
+              workdir, output, baseline):
+    """Measure the throughput of the OnlyFiles operations on synthetic directory trees"""
+    try:
+        parse_extensions(extensions)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--extensions')
+
+    spec = TreeSpec(files, depth, fanout, sizes, extensions, unicode_ratio, seed)
+    report = run_benchmarks(spec, operations or OPERATIONS, repeat, workdir, workers, summary)
+
+    previous = None
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    _show_results(report, previous)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    console.print(f"Results written to {output}")
+
+
+def main():
+    """Entry point of the onlyfiles-bench command"""
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
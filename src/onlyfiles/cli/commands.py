@@ -3,13 +3,20 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
 from typing import Optional
+import json
 import sys
 import os
 
 from onlyfiles.utils.logger import Logger
-from onlyfiles.core.file_manager import FileManager
-from onlyfiles.core.execution import Execution
+from onlyfiles.core.file_manager import FileManager, BACKUP_MODES, DUPLICATE_ACTIONS, WATCH_MODES
+from onlyfiles.core.mover import DEFAULT_WORKERS
+from onlyfiles.core.planner import MovePlan
+from onlyfiles.core.duplicates import DUPLICATES_DIR, wasted_bytes
+from onlyfiles.core.watcher import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE
+from onlyfiles.core.rules import RuleSet
+from onlyfiles.core.stats import RunStats
 from onlyfiles.utils.help_manager import HelpManager
+from onlyfiles.utils.log_reader import DEFAULT_TAIL, DEFAULT_PAGE_SIZE, LogFilter, parse_time
 from onlyfiles.cli.terminal_interface import TerminalInterface
 
 # Initialize console
@@ -28,6 +35,93 @@ def __show_warning(message: str):
     """Private method to display warning messages"""
     console.print(f"[yellow]{message}[/yellow]")
 
+def __show_plan(plan, plan_file: Optional[str] = None):
+    """Private method to display a move plan and optionally export it"""
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("File", style="dim")
+    table.add_column("Destination")
+    table.add_column("Size", justify="right")
+
+    for move in plan:
+        table.add_row(os.path.relpath(move.source, plan.root),
+                      os.path.relpath(os.path.dirname(move.destination), plan.root),
+                      str(move.size))
+
+    console.print(Panel(table, title=f"Move plan ({plan.mode})", border_style="blue"))
+    console.print(f"{len(plan)} files, {plan.total_size} bytes")
+
+    if plan_file:
+        plan.save(plan_file)
+        __show_success(f"Plan exported to {plan_file}")
+
+def __show_stats(stats, stats_json: Optional[str] = None, show: bool = True):
+    """Private method to display the per-phase statistics of a run and optionally export them"""
+    report = stats.to_dict()
+    if show:
+        wall = max(report['wall_seconds'], 1e-9)
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Phase")
+        table.add_column("Calls", justify="right")
+        table.add_column("Time", justify="right")
+        table.add_column("Share", justify="right")
+        for phase, values in report['phases'].items():
+            table.add_row(phase, str(values['calls']), f"{values['seconds']:.3f}s", f"{values['seconds'] / wall:.1%}")
+        for counter, value in report['counters'].items():
+            table.add_row(f"[dim]{counter}[/dim]", str(value), "", "")
+        console.print(Panel(table, title=f"Run statistics ({report['wall_seconds']:.3f}s)", border_style="blue"))
+        # Moves run on several workers, their times add up
+        console.print("Phase times exclude the phases they call, concurrent phases add up the time of every thread")
+
+    if stats_json:
+        with open(stats_json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        __show_success(f"Statistics exported to {stats_json}")
+
+def __show_duplicates(groups, root: str):
+    """Private method to display the groups of duplicate files"""
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Group", justify="right")
+    table.add_column("Files", style="dim")
+    table.add_column("Size", justify="right")
+
+    for number, group in enumerate(groups, 1):
+        table.add_row(str(number), "\n".join(os.path.relpath(path, root) for path in group), str(os.path.getsize(group[0])))
+
+    console.print(Panel(table, title="Duplicate files", border_style="blue"))
+    console.print(f"{len(groups)} groups, {wasted_bytes(groups)} bytes wasted")
+
+def __handle_duplicates(file_manager, directory: str, action: str, recursive: bool, max_depth: Optional[int],
+                        dry_run: bool, plan_file: Optional[str]):
+    """Private method to report, link or move the duplicate files of a directory"""
+    groups = file_manager.find_duplicates(directory, recursive, max_depth)
+    if groups is None:
+        __show_error("Failed to find duplicate files")
+        return
+    if not groups:
+        __show_success("No duplicate files found")
+        return
+    if action == 'report':
+        __show_duplicates(groups, directory)
+        return
+
+    if action == 'move':
+        plan = file_manager.plan_duplicates(directory, groups)
+        if dry_run:
+            __show_plan(plan, plan_file)
+        elif file_manager.apply_plan(plan):
+            __show_success(f"{len(plan)} duplicates moved to the {DUPLICATES_DIR} folder")
+        else:
+            __show_error("Failed to move some duplicates")
+        return
+
+    wasted = wasted_bytes(groups)
+    if dry_run:
+        __show_duplicates(groups, directory)
+    elif file_manager.link_duplicates(groups):
+        __show_success(f"Duplicates replaced with hardlinks, {wasted} bytes freed")
+    else:
+        __show_error("Failed to link some duplicates")
+
 # Modifying the main group to not require subcommands
 @click.group(invoke_without_command=True, context_settings=dict(help_option_names=['-h', '--help']))
 @click.version_option('1.0.0', '--version', prog_name="OnlyFiles", message="%(prog)s, version %(version)s")
@@ -37,16 +131,52 @@ def __show_warning(message: str):
 @click.option('--date', '-t', is_flag=True, help='Organize by date')
 @click.option('--size', '-s', is_flag=True, help='Organize by size')
 @click.option('--type', '-y', is_flag=True, help='Organize by type')
+@click.option('--rules', type=click.Path(exists=True, dir_okay=False), default=None, help='Organize with the rules of a JSON file')
 @click.option('--backup', '-b', is_flag=True, help='Create backup of files')
 @click.option('--revert', '-r', is_flag=True, help='Revert to last backup')
+@click.option('--prune', is_flag=True, help='When reverting, delete files created after the backup')
+@click.option('--verify', is_flag=True, help='When reverting, also compare files by content hash')
+@click.option('--backup-mode', type=click.Choice(BACKUP_MODES), default='snapshot', help='Backup as a linked snapshot folder or in the deduplicating store')
 @click.option('--move', '-m', is_flag=True, help='Move files')
+@click.option('--duplicates', '-D', is_flag=True, help='Find duplicate files')
+@click.option('--dup-action', type=click.Choice(DUPLICATE_ACTIONS), default='report',
+              help='Report duplicates, replace them with hardlinks or move them to the Duplicates folder')
 @click.option('--drives', is_flag=True, help='List available drives')
 @click.option('--logs', '-l', is_flag=True, help='View operation logs')
 @click.option('--clear-logs', '-c', is_flag=True, help='Clear operation logs')
+@click.option('--since', default=None, help='With --logs, records from this time (YYYY-MM-DD [HH:MM:SS] or 30m, 1h, 2d)')
+@click.option('--until', default=None, help='With --logs, records up to this time')
+@click.option('--level', type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], case_sensitive=False),
+              default=None, help='With --logs, records of this level and above')
+@click.option('--logger-name', default=None, help='With --logs, records of this logger only')
+@click.option('--grep', default=None, help='With --logs, records containing this text')
+@click.option('--tail', type=click.IntRange(min=1), default=None, help=f'With --logs, the last N matching records (default: {DEFAULT_TAIL})')
+@click.option('--page', type=click.IntRange(min=1), default=None, help='With --logs, page N of the matching records, oldest first')
+@click.option('--page-size', type=click.IntRange(min=1), default=DEFAULT_PAGE_SIZE, help='Number of records of a page')
+@click.option('--recursive', '-R', is_flag=True, help='Organize subdirectories recursively')
+@click.option('--max-depth', type=click.IntRange(min=0), default=None, help='Maximum depth for recursive organization')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=DEFAULT_WORKERS, help='Number of concurrent file moves')
+@click.option('--sniff', is_flag=True, help='Detect the type of files without a known or with a wrong extension from their content')
+@click.option('--incremental', '-i', is_flag=True, help='Skip the directories unchanged since the last run')
+@click.option('--summary', is_flag=True, help='Log per-category totals and throughput instead of every moved file')
+@click.option('--stats', is_flag=True, help='Show the time and calls of each phase of the run')
+@click.option('--stats-json', type=click.Path(dir_okay=False), default=None, help='Export the statistics of the run to a JSON file')
+@click.option('--async-logs', is_flag=True, help='Write logs from a background thread')
+@click.option('--dry-run', is_flag=True, help='Show the planned moves without moving any file')
+@click.option('--plan-file', type=click.Path(dir_okay=False), default=None, help='Export the plan of a dry run to a JSON file')
+@click.option('--apply-plan', type=click.Path(exists=True, dir_okay=False), default=None, help='Apply a plan exported with --plan-file, with --dry-run only show it')
 @click.pass_context
 def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: bool = False, date: bool = False, size: bool = False, 
         type: bool = False, backup: bool = False, revert: bool = False, move: bool = False, 
-        drives: bool = False, logs: bool = False, clear_logs: bool = False):
+        drives: bool = False, logs: bool = False, clear_logs: bool = False, recursive: bool = False,
+        max_depth: Optional[int] = None, workers: int = DEFAULT_WORKERS, dry_run: bool = False,
+        plan_file: Optional[str] = None, apply_plan: Optional[str] = None, backup_mode: str = 'snapshot',
+        prune: bool = False, verify: bool = False, summary: bool = False, async_logs: bool = False,
+        since: Optional[str] = None, until: Optional[str] = None, level: Optional[str] = None,
+        logger_name: Optional[str] = None, grep: Optional[str] = None, tail: Optional[int] = None,
+        page: Optional[int] = None, page_size: int = DEFAULT_PAGE_SIZE, duplicates: bool = False,
+        dup_action: str = 'report', sniff: bool = False, incremental: bool = False, rules: Optional[str] = None,
+        stats: bool = False, stats_json: Optional[str] = None):
     """
     Main CLI command group for OnlyFiles.
 
@@ -55,21 +185,29 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
     - File organization (by extension, date, size, type)
     - File backup and restore
     - File movement
+    - Duplicate file detection
+    - Move planning (dry run, plan export and apply)
     - Drive listing
     - Log management
     """
     try:
-        # Initialize logger and execution
-        logger = Logger("OnlyFiles")
-        execution = Execution(logger)
-        file_manager = FileManager(logger)
+        # Initialize logger and file manager
+        logger = Logger("OnlyFiles", queued=async_logs or None)
+        run_stats = RunStats() if stats or stats_json else None
+        file_manager = FileManager(logger, workers, summary=summary, sniff=sniff, incremental=incremental,
+                                   stats=run_stats)
+        if run_stats is not None:
+            ctx.call_on_close(lambda: __show_stats(run_stats, stats_json, stats))
+        # Registered last so it runs first, queued records are written before the command returns
+        ctx.call_on_close(logger.flush)
 
         if ctx.invoked_subcommand is None:
             if help:
                 print(help_manager.get_help_content())
                 return
                 
-            if not any([extension, date, size, type, backup, revert, move, drives, logs, clear_logs]):
+            if not any([extension, date, size, type, backup, revert, move, drives, logs, clear_logs, apply_plan,
+                        duplicates, rules]):
                 print(help_manager.get_help_content())
                 return
 
@@ -86,10 +224,25 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
                 return
 
             if logs:
-                log_content = logger.handle_logs('read')
+                try:
+                    log_filter = LogFilter(since=parse_time(since) if since else None,
+                                           until=parse_time(until) if until else None,
+                                           min_level=level.upper() if level else None,
+                                           name=logger_name, contains=grep)
+                except ValueError as e:
+                    __show_error(f"Error: {str(e)}")
+                    return
+
+                # Without a page, only the most recent records are read, from the end of the file
+                logger.flush()
+                records = logger.query_logs(log_filter, None if page else tail or DEFAULT_TAIL, page, page_size)
                 console.print("\n=== Operation Logs ===\n")
-                console.print(log_content)
-                console.print("\n=== End of Logs ===\n")
+                if records:
+                    for record in records:
+                        console.print(record.text, markup=False, highlight=False)
+                else:
+                    console.print("No logs found")
+                console.print(f"\n=== End of Logs ({len(records)} records) ===\n")
                 return
 
             if clear_logs:
@@ -97,22 +250,69 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
                 __show_success(result)
                 return
 
+            if plan_file and not dry_run:
+                __show_error("Error: --plan-file exports the plan of a dry run, use it with --dry-run.")
+                return
+
+            if apply_plan:
+                if dry_run:
+                    # Only shows the moves of the plan, nothing is moved
+                    __show_plan(MovePlan.load(apply_plan), plan_file)
+                    return
+                if file_manager.apply_plan(MovePlan.load(apply_plan)):
+                    __show_success(f"Plan {apply_plan} applied successfully")
+                else:
+                    __show_error(f"Failed to apply plan {apply_plan}")
+                return
+
             if not directory:
                 __show_error("Error: Directory not specified. Use --directory or -d to specify a directory.")
                 return
 
+            if duplicates:
+                __handle_duplicates(file_manager, directory, dup_action, recursive, max_depth, dry_run, plan_file)
+                return
+
+            rule_set = None
+            if rules:
+                try:
+                    rule_set = RuleSet.load(rules)
+                except (OSError, ValueError) as e:
+                    __show_error(f"Error loading rules from {rules}: {str(e)}")
+                    return
+
+            if dry_run:
+                planners = [(rules, lambda *args: file_manager.plan_by_rules(args[0], rule_set, *args[1:])),
+                            (extension, file_manager.plan_by_extension), (date, file_manager.plan_by_date),
+                            (size, file_manager.plan_by_size), (type, file_manager.plan_by_type)]
+                planner = next((planner for selected, planner in planners if selected), None)
+                if planner is None:
+                    __show_error("Error: --dry-run requires an organize mode (--extension, --date, --size, --type or --rules).")
+                    return
+                plan = planner(directory, recursive, max_depth)
+                if plan is not None:
+                    __show_plan(plan, plan_file)
+                return
+
+            if rules:
+                if file_manager.organize_by_rules(directory, rule_set, recursive, max_depth):
+                    __show_success(f"Files organized with {len(rule_set)} rules from {rules}")
+                else:
+                    __show_error("Failed to organize files with the rules")
+                return
+
             if extension:
-                if file_manager.organize_by_extension(directory):
+                if file_manager.organize_by_extension(directory, recursive, max_depth):
                     __show_success("Files organized by extension successfully")
                 return
 
             if date:
-                if file_manager.organize_by_date(directory):
+                if file_manager.organize_by_date(directory, recursive, max_depth):
                     __show_success("Files organized by date successfully")
                 return
 
             if size:
-                if file_manager.organize_by_size(directory):
+                if file_manager.organize_by_size(directory, recursive, max_depth):
                     __show_success("Files organized by size successfully")
                 return
 
@@ -120,7 +320,7 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
                 if not directory:
                     __show_error("Error: Directory not specified. Use --directory or -d to specify a directory.")
                     return
-                result = file_manager.organize_by_type(directory)
+                result = file_manager.organize_by_type(directory, recursive, max_depth)
                 if result:
                     __show_success(f"Files organized by type in {directory}")
                 else:
@@ -128,14 +328,16 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
                 return
 
             if backup:
-                backup_dir = file_manager.create_backup(directory)
+                backup_dir = file_manager.create_backup(directory, backup_mode)
                 if backup_dir:
                     __show_success(f"Backup created successfully at {backup_dir}")
                 return
 
             if revert:
-                if file_manager.revert_backup(directory):
-                    __show_success("Successfully reverted to backup")
+                if file_manager.revert_backup(directory, prune, verify):
+                    report = file_manager.restore_report
+                    __show_success(f"Successfully reverted to backup ({len(report.restored)} restored, "
+                                   f"{len(report.deleted)} deleted, {report.unchanged} unchanged)")
                 return
 
             if move:
@@ -150,4 +352,27 @@ def cli(ctx, help: bool = False, directory: Optional[str] = None, extension: boo
 def start():
     """Start the interactive terminal interface"""
     interface = TerminalInterface()
-    interface.start() 
\ No newline at end of file
+    interface.start()
+
+@cli.command()
+@click.option('--directory', '-d', type=click.Path(exists=True, file_okay=False, dir_okay=True), required=True,
+              help='Directory to watch')
+@click.option('--mode', type=click.Choice(WATCH_MODES), default='type', help='Organize mode of the new files')
+@click.option('--debounce', type=click.FloatRange(min=0), default=DEFAULT_DEBOUNCE,
+              help='Seconds a file must stay unchanged before it is organized')
+@click.option('--poll-interval', type=click.FloatRange(min=0.1), default=DEFAULT_POLL_INTERVAL,
+              help='Seconds between two scans when inotify is not available')
+@click.option('--polling', is_flag=True, help='Scan the directory instead of using inotify')
+@click.option('--settle', type=click.FloatRange(min=0), default=DEFAULT_SETTLE,
+              help='When scanning, seconds a file must keep its size and modification time before it counts as '
+                   'written, a scan cannot tell that a writer still has it open')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=DEFAULT_WORKERS, help='Number of concurrent file moves')
+@click.option('--sniff', is_flag=True, help='Detect the type of files without a known or with a wrong extension from their content')
+def watch(directory: str, mode: str = 'type', debounce: float = DEFAULT_DEBOUNCE,
+          poll_interval: float = DEFAULT_POLL_INTERVAL, polling: bool = False, workers: int = DEFAULT_WORKERS,
+          sniff: bool = False, settle: float = DEFAULT_SETTLE):
+    """Organize the files dropped into a directory as they arrive"""
+    file_manager = FileManager(Logger("OnlyFiles"), workers, sniff=sniff)
+    console.print(f"Watching {directory}, press Ctrl+C to stop")
+    if not file_manager.watch(directory, mode, debounce, poll_interval, polling, settle=settle):
+        __show_error(f"Failed to watch {directory}")
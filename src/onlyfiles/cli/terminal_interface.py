@@ -6,6 +6,7 @@ from rich.panel import Panel
 from onlyfiles.utils.logger import Logger
 from onlyfiles.core.execution import Execution
 from onlyfiles.core.file_manager import FileManager
+from onlyfiles.utils.log_reader import DEFAULT_TAIL
 
 console = Console()
 
@@ -115,7 +116,7 @@ class TerminalInterface:
             console.print("[green]Files organized successfully![/green]")
 
             # Check if logs were registered
-            log_content = self.logger.handle_logs('read')
+            log_content = self.logger.handle_logs('read', 1)
             if not log_content or "No logs found" in log_content:
                 self.logger.warning("No logs were generated during file organization")
         except Exception as e:
@@ -225,7 +226,7 @@ class TerminalInterface:
 
     def show_logs(self):
         """Shows operation logs."""
-        log_content = self.logger.handle_logs('read')
+        log_content = self.logger.handle_logs('read', DEFAULT_TAIL)
 
         if not log_content:
             self.__show_message_and_wait("Log file is empty.")
@@ -279,7 +280,7 @@ class TerminalInterface:
 
     def select_logs_to_revert(self):
         """Select specific logs to revert"""
-        logs = self.file_manager.read_logs()
+        logs = self.file_manager.read_logs(DEFAULT_TAIL)
         move_logs = self.file_manager.get_move_logs(logs)
 
         if not move_logs:
@@ -0,0 +1,276 @@
+"""
+Incremental snapshot backups.
+Each snapshot is a full tree of the backed up directory, but files that did
+not change since the previous snapshot (same size and mtime_ns) are
+hardlinked to it instead of being copied again. Restores compare a backup
+manifest with the current tree and only touch the entries that differ.
+"""
+
+import errno
+import os
+import re
+import shutil
+import stat as stat_module
+from collections import namedtuple
+
+from onlyfiles.core.copier import CopyEngine
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+# Folder names of the backups created inside a directory
+BACKUP_PREFIX = 'backup_'
+BACKUP_DIR_PATTERN = re.compile(r'^backup_(\d+)$')
+
+# Linux ioctl request to clone a file's extents (copy-on-write reflink)
+FICLONE = 0x40049409
+
+# Errors of os.link that mean the file system can't hardlink this file
+_LINK_ERRORS = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP)
+
+
+class SnapshotStats(namedtuple('SnapshotStats', ['linked', 'copied', 'bytes_copied'])):
+    """Number of files linked from the previous snapshot and copied, and bytes copied"""
+
+    __slots__ = ()
+
+
+def is_backup_name(name):
+    """Return True if name is the folder name of a backup"""
+    return BACKUP_DIR_PATTERN.match(name) is not None
+
+
+def backup_timestamp(name):
+    """Return the timestamp of a backup name"""
+    return int(BACKUP_DIR_PATTERN.match(name).group(1))
+
+
+def list_backups(directory):
+    """Return the backup folder names of a directory, oldest first"""
+    backups = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = BACKUP_DIR_PATTERN.match(entry.name)
+            if match and entry.is_dir(follow_symlinks=False):
+                backups.append(entry.name)
+    return sorted(backups, key=backup_timestamp)
+
+
+def new_backup_name(directory, timestamp, taken=()):
+    """Return a backup name for timestamp that isn't taken and doesn't exist yet in directory"""
+    timestamp = int(timestamp)
+    while f'{BACKUP_PREFIX}{timestamp}' in taken or os.path.lexists(os.path.join(directory, f'{BACKUP_PREFIX}{timestamp}')):
+        timestamp += 1
+    return f'{BACKUP_PREFIX}{timestamp}'
+
+
+def is_unchanged(stat, previous_stat):
+    """Return True if a file has the same size and modification time as its previous copy"""
+    return stat.st_size == previous_stat.st_size and stat.st_mtime_ns == previous_stat.st_mtime_ns
+
+
+def reflink(source, destination):
+    """Clone source into destination sharing its data blocks, raise OSError if unsupported"""
+    import fcntl  # Not available on Windows, where the ImportError means unsupported
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+def link_unchanged(previous, destination):
+    """Reuse the previous copy of an unchanged file, return False if it must be copied"""
+    try:
+        os.link(previous, destination)
+        return True
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+
+    # Hardlinks not possible here, try a copy-on-write clone
+    try:
+        reflink(previous, destination)
+        return True
+    except (ImportError, OSError):
+        if os.path.lexists(destination):
+            os.remove(destination)
+        return False
+
+
+def walk_tree(source, skip=None):
+    """
+    Yield (relative path, entry) for every folder, file and symlink under source, parents first.
+
+    Parameters:
+    source (str): Directory to walk
+    skip (callable): Called with a top level entry name of source, return True to leave it out
+    """
+    # Depth-first stack of (folder path, folder path relative to source)
+    stack = [(source, '')]
+    while stack:
+        folder, relative = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not relative and skip is not None and skip(entry.name):
+                    continue
+
+                path = os.path.join(relative, entry.name)
+                yield path, entry
+                # Directory symlinks are yielded as links, never followed
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, path))
+
+
+def create_snapshot(source, target, previous=None, skip=None, max_workers=DEFAULT_WORKERS):
+    """
+    Copy the tree of source into target, linking files unchanged since the previous snapshot.
+
+    Parameters:
+    source (str): Directory to back up
+    target (str): Snapshot folder to create
+    previous (str): Previous snapshot folder of the same directory, or None for a full copy
+    skip (callable): Called with a top level entry name of source, return True to leave it out
+    max_workers (int): Number of changed files copied concurrently
+
+    Returns:
+    SnapshotStats: Number of files linked and copied
+    """
+    linked = copied = bytes_copied = 0
+    engine = CopyEngine(max_workers)
+
+    os.makedirs(target)
+    # Folders whose metadata is copied once their content is written
+    folders = [(source, target)]
+    for relative, entry in walk_tree(source, skip):
+        dst = os.path.join(target, relative)
+
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), dst)
+        elif entry.is_dir():
+            os.mkdir(dst)
+            folders.append((entry.path, dst))
+        else:
+            stat = entry.stat()
+            if previous is not None:
+                prev = os.path.join(previous, relative)
+                try:
+                    unchanged = is_unchanged(stat, os.stat(prev, follow_symlinks=False))
+                except OSError:
+                    unchanged = False  # New file
+                if unchanged and link_unchanged(prev, dst):
+                    linked += 1
+                    continue
+
+            engine.submit(entry.path, dst)
+            copied += 1
+            bytes_copied += stat.st_size
+
+    failed = engine.wait()
+    if failed:
+        raise failed[0].error
+
+    for src_dir, dst_dir in reversed(folders):
+        shutil.copystat(src_dir, dst_dir)
+
+    return SnapshotStats(linked, copied, bytes_copied)
+
+
+class RestoreReport(namedtuple('RestoreReport', ['restored', 'deleted', 'unchanged'])):
+    """Relative paths restored from a backup and deleted, and number of entries left untouched"""
+
+    __slots__ = ()
+
+
+def snapshot_manifest(snapshot):
+    """
+    Return the manifest of a snapshot folder.
+
+    Manifests hold the relative 'folders' of a backup, its 'links' with their targets
+    and its 'files' as [size, mtime_ns, mode, hash], hash being None for snapshots.
+    """
+    folders, links, files = [], {}, {}
+    for relative, entry in walk_tree(snapshot):
+        if entry.is_symlink():
+            links[relative] = os.readlink(entry.path)
+        elif entry.is_dir():
+            folders.append(relative)
+        else:
+            stat = entry.stat()
+            files[relative] = [stat.st_size, stat.st_mtime_ns, stat_module.S_IMODE(stat.st_mode), None]
+    return {'folders': folders, 'links': links, 'files': files}
+
+
+def restore_tree(target, manifest, write_file, delete_extra=False, skip=None, record_hash=None, file_hash=None):
+    """
+    Bring target back to the state of a backup manifest, touching only what differs.
+
+    Parameters:
+    target (str): Directory to restore
+    manifest (dict): Manifest of the backup, see snapshot_manifest
+    write_file (callable): Called with (relative path, file record, destination) to restore a file
+    delete_extra (bool): Delete files and folders created after the backup
+    skip (callable): Called with a top level entry name of target, return True to leave it untouched
+    record_hash (callable): Called with (relative path, file record), returns the backed up content hash.
+                            When given, files with the same size and mtime_ns are also compared by hash
+    file_hash (callable): Called with a path, returns the content hash of a current file
+
+    Returns:
+    RestoreReport: What was restored and deleted
+    """
+    folders = set(manifest['folders'])
+    links = manifest['links']
+    files = manifest['files']
+
+    unchanged = 0
+    seen = set()
+    extra = []
+    for relative, entry in walk_tree(target, skip):
+        if entry.is_symlink():
+            if links.get(relative) == os.readlink(entry.path):
+                seen.add(relative)
+                unchanged += 1
+            elif relative not in links and relative not in files:
+                extra.append(entry)
+        elif entry.is_dir():
+            if relative in folders:
+                seen.add(relative)
+            else:
+                extra.append(entry)
+        else:
+            record = files.get(relative)
+            if record is None:
+                extra.append(entry)
+                continue
+            stat = entry.stat()
+            if stat.st_size == record[0] and stat.st_mtime_ns == record[1]:
+                if record_hash is None or file_hash(entry.path) == record_hash(relative, record):
+                    seen.add(relative)
+                    unchanged += 1
+
+    deleted = []
+    if delete_extra:
+        # Entries are listed parents first, so folders are emptied before they are removed
+        for entry in reversed(extra):
+            if entry.is_dir(follow_symlinks=False):
+                os.rmdir(entry.path)
+            else:
+                os.remove(entry.path)
+            deleted.append(os.path.relpath(entry.path, target))
+
+    restored = []
+    for relative in sorted(folders - seen):
+        os.makedirs(os.path.join(target, relative), exist_ok=True)
+    for relative, link in links.items():
+        if relative not in seen:
+            destination = os.path.join(target, relative)
+            if os.path.lexists(destination):
+                os.remove(destination)
+            os.symlink(link, destination)
+            restored.append(relative)
+    for relative, record in files.items():
+        if relative not in seen:
+            destination = os.path.join(target, relative)
+            if os.path.islink(destination):
+                os.remove(destination)
+            write_file(relative, record, destination)
+            restored.append(relative)
+
+    return RestoreReport(restored, deleted, unchanged)
@@ -0,0 +1,201 @@
+"""
+Content-addressed backup store.
+File contents are stored once under their SHA-256 hash, whatever their name,
+location or backup generation, and each backup is a small manifest mapping
+relative paths to hashes.
+"""
+
+import hashlib
+import json
+import os
+import stat as stat_module
+import tempfile
+from collections import namedtuple
+
+from onlyfiles.core.backup import backup_timestamp, is_backup_name, restore_tree, walk_tree
+from onlyfiles.core.copier import CopyEngine, copy_data
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+# Folder of the store inside the backed up directory
+STORE_DIR = '.onlyfiles_store'
+
+# Version of the manifest format
+MANIFEST_FORMAT = 1
+
+# Size of the blocks read while hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+class StoreStats(namedtuple('StoreStats', ['stored', 'deduplicated', 'bytes_stored'])):
+    """Number of new objects stored and of files whose content was already stored, and bytes stored"""
+
+    __slots__ = ()
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BackupStore:
+    """
+    Deduplicating backup store kept in a hidden folder of the backed up directory.
+
+    Manifests are JSON files with the folders, symlinks and files of a backup,
+    files being stored as [size, mtime_ns, mode, hash] (see backup.snapshot_manifest).
+
+    file_hash is called with a path to hash the current files, hash_file by default.
+
+    Usage example:
+        store = BackupStore('/data/share')
+        store.create('backup_1700000000')
+        report = store.restore('backup_1700000000', '/data/share')
+    """
+
+    def __init__(self, directory, file_hash=hash_file):
+        self.directory = directory
+        self.__file_hash = file_hash
+        self.root = os.path.join(directory, STORE_DIR)
+        self.__objects = os.path.join(self.root, 'objects')
+        self.__manifests = os.path.join(self.root, 'manifests')
+
+    def list_backups(self):
+        """Return the backup names of the store, oldest first"""
+        try:
+            names = [name[:-len('.json')] for name in os.listdir(self.__manifests) if name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+        return sorted((name for name in names if is_backup_name(name)), key=backup_timestamp)
+
+    def object_path(self, digest):
+        """Return the path of the object holding the content with this hash"""
+        return os.path.join(self.__objects, digest[:2], digest[2:])
+
+    def manifest_path(self, name):
+        """Return the path of the manifest of a backup"""
+        return os.path.join(self.__manifests, f'{name}.json')
+
+    def load_manifest(self, name):
+        """Read the manifest of a backup"""
+        with open(self.manifest_path(name), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != MANIFEST_FORMAT:
+            raise ValueError(f"Unsupported manifest format: {manifest.get('format')}")
+        return manifest
+
+    def __write_atomic(self, path, write):
+        """Private method to write a file through a temporary file renamed into place"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def __store_object(self, source, digest):
+        """Private method to store the content of a file, return False if it was already stored"""
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return False
+
+        def write(f):
+            with open(source, 'rb') as src:
+                copy_data(src.fileno(), f.fileno())
+
+        self.__write_atomic(path, write)
+        return True
+
+    def create(self, name, skip=None):
+        """
+        Store the current content of the directory as a new backup.
+
+        Parameters:
+        name (str): Backup name, as returned by backup.new_backup_name
+        skip (callable): Called with a top level entry name, return True to leave it out
+
+        Returns:
+        StoreStats: Number of objects stored and files deduplicated
+        """
+        # Files unchanged since the last backup reuse its hash instead of being read again
+        backups = self.list_backups()
+        previous = self.load_manifest(backups[-1])['files'] if backups else {}
+
+        def skip_entry(entry_name):
+            # The store never backs itself up
+            return entry_name == STORE_DIR or (skip is not None and skip(entry_name))
+
+        stored = deduplicated = bytes_stored = 0
+        folders, links, files = [], {}, {}
+        for relative, entry in walk_tree(self.directory, skip_entry):
+            if entry.is_symlink():
+                links[relative] = os.readlink(entry.path)
+            elif entry.is_dir():
+                folders.append(relative)
+            else:
+                stat = entry.stat()
+                known = previous.get(relative)
+                if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                    digest = known[3]
+                else:
+                    digest = self.__file_hash(entry.path)
+
+                if self.__store_object(entry.path, digest):
+                    stored += 1
+                    bytes_stored += stat.st_size
+                else:
+                    deduplicated += 1
+                files[relative] = [stat.st_size, stat.st_mtime_ns, stat_module.S_IMODE(stat.st_mode), digest]
+
+        manifest = {'format': MANIFEST_FORMAT, 'folders': folders, 'links': links, 'files': files}
+        data = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.__write_atomic(self.manifest_path(name), lambda f: f.write(data))
+        return StoreStats(stored, deduplicated, bytes_stored)
+
+    def restore_file(self, record, destination, engine):
+        """Schedule writing a file of a manifest to destination with its mode and modification time"""
+        size, mtime_ns, mode, digest = record
+
+        def finish(path):
+            os.chmod(path, mode)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+        engine.submit(self.object_path(digest), destination, finish)
+
+    def restore(self, name, target, delete_extra=False, skip=None, verify=False, max_workers=DEFAULT_WORKERS):
+        """
+        Restore a backup into target, writing only the files that differ from the manifest.
+
+        Parameters:
+        name (str): Backup name
+        target (str): Directory to restore
+        delete_extra (bool): Delete files and folders created after the backup
+        skip (callable): Called with a top level entry name of target, return True to leave it untouched
+        verify (bool): Also compare the content hash of files with the same size and mtime_ns
+        max_workers (int): Number of files written concurrently
+
+        Returns:
+        RestoreReport: What was restored and deleted
+        """
+        def skip_entry(entry_name):
+            return entry_name == STORE_DIR or (skip is not None and skip(entry_name))
+
+        engine = CopyEngine(max_workers)
+
+        def write_file(relative, record, destination):
+            self.restore_file(record, destination, engine)
+
+        record_hash = (lambda relative, record: record[3]) if verify else None
+        report = restore_tree(target, self.load_manifest(name), write_file, delete_extra, skip_entry, record_hash,
+                              self.__file_hash)
+
+        failed = engine.wait()
+        if failed:
+            raise failed[0].error
+        return report
@@ -0,0 +1,172 @@
+"""
+Parallel file copy engine.
+File data is copied inside the kernel with os.copy_file_range or os.sendfile
+where the platform supports it, falling back to a buffered copy, and many
+files are copied at once on a thread pool.
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+# Number of bytes copied by a single system call
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Errors meaning a kernel copy method can't be used for these files
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP,
+                       errno.EBADF, errno.ENOTSOCK, errno.EPERM}
+
+
+class CopyResult(namedtuple('CopyResult', ['source', 'destination', 'error'])):
+    """Outcome of a single copy, error holds the raised exception when it failed"""
+
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+def _copy_with(copy_chunk, infd, outfd, chunk_size):
+    """Copy with a kernel method until the end of the file, return False if it isn't supported"""
+    copied = False
+    try:
+        while copy_chunk(infd, outfd, chunk_size) > 0:
+            copied = True
+    except OSError as e:
+        # Once data went through, the method works for these files and the error is real
+        if copied or e.errno not in _UNSUPPORTED_ERRORS:
+            raise
+        return False
+    if not copied and os.lseek(infd, 0, os.SEEK_CUR) < os.fstat(infd).st_size:
+        # Some file systems (e.g. procfs, some FUSE mounts) report no data instead of an error
+        return False
+    return True
+
+
+def copy_data(infd, outfd, chunk_size=CHUNK_SIZE):
+    """Copy the rest of the file open as infd to outfd, in chunks of chunk_size bytes"""
+    if hasattr(os, 'copy_file_range'):
+        # Can clone blocks or copy server side on file systems that support it
+        if _copy_with(os.copy_file_range, infd, outfd, chunk_size):
+            return
+    if hasattr(os, 'sendfile'):
+        if _copy_with(lambda i, o, n: os.sendfile(o, i, None, n), infd, outfd, chunk_size):
+            return
+
+    # Unbuffered file objects keep reading and writing at the current offsets of the descriptors
+    with open(infd, 'rb', buffering=0, closefd=False) as src, open(outfd, 'wb', buffering=0, closefd=False) as dst:
+        shutil.copyfileobj(src, dst, min(chunk_size, 1024 * 1024))
+
+
+def copy_file(source, destination, chunk_size=CHUNK_SIZE):
+    """Copy the data and metadata of a file, like shutil.copy2"""
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        copy_data(src.fileno(), dst.fileno(), chunk_size)
+    shutil.copystat(source, destination)
+    return destination
+
+
+def move_file(source, destination):
+    """Move a file, copying it with copy_file when it crosses devices"""
+    try:
+        os.rename(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        if os.path.islink(source):
+            # Move the link itself, not the file it points to
+            os.symlink(os.readlink(source), destination)
+            os.unlink(source)
+            return destination
+
+        try:
+            copy_file(source, destination)
+            # The source is only removed once the copy is known to be complete
+            expected, copied = os.stat(source).st_size, os.stat(destination).st_size
+            if copied != expected:
+                raise OSError(errno.EIO, f"Incomplete copy, {copied} of {expected} bytes", destination)
+        except BaseException:
+            try:
+                os.unlink(destination)
+            except OSError:
+                pass
+            raise
+        os.unlink(source)
+    return destination
+
+
+class CopyEngine:
+    """
+    Thread-pool engine for file copies.
+
+    Copies run concurrently on up to max_workers threads, or inline with a
+    single worker. By default the metadata is copied like shutil.copy2, a
+    finish callable can set it instead.
+
+    Usage example:
+        engine = CopyEngine(max_workers=8)
+        engine.submit('/data/a.iso', '/backup/a.iso')
+        failed = engine.wait()
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE):
+        self.__max_workers = max(1, max_workers or 1)
+        self.__chunk_size = chunk_size
+        # Only failed copies are kept, a backup may copy millions of files
+        self.__failed = []
+        self.__lock = threading.Lock()
+        self.__pool = None
+        if self.__max_workers > 1:
+            self.__pool = ThreadPoolExecutor(max_workers=self.__max_workers)
+            # Bound the queued copies so tree walks keep a bounded working set
+            self.__slots = threading.BoundedSemaphore(self.__max_workers * 8)
+
+    @property
+    def max_workers(self):
+        """Return the number of concurrent copies"""
+        return self.__max_workers
+
+    def submit(self, source, destination, finish=None):
+        """Schedule a copy of source to destination, finish is called with the copy before it replaces destination"""
+        if self.__pool is None:
+            self.__run(source, destination, finish)
+            return
+
+        self.__slots.acquire()
+        future = self.__pool.submit(self.__run, source, destination, finish)
+        future.add_done_callback(lambda f: self.__slots.release())
+
+    def __run(self, source, destination, finish):
+        """Execute one copy and record its failure"""
+        try:
+            # A file replacing destination is written beside it and renamed over it, writing into
+            # destination itself would also change every hardlink to it, e.g. in a backup snapshot
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.tmp_')
+            try:
+                with open(source, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                    copy_data(src.fileno(), dst.fileno(), self.__chunk_size)
+                if finish is None:
+                    shutil.copystat(source, temporary)
+                else:
+                    finish(temporary)
+                os.replace(temporary, destination)
+            except BaseException:
+                os.remove(temporary)
+                raise
+        except Exception as e:
+            with self.__lock:
+                self.__failed.append(CopyResult(source, destination, e))
+
+    def wait(self):
+        """Wait for all scheduled copies and return the ones that failed"""
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+            self.__pool = None
+        return list(self.__failed)
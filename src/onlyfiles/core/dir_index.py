@@ -0,0 +1,198 @@
+"""
+Persistent index of organized directories.
+After a run, each directory left in a known state is recorded with its
+modification time, its subfolders and the files that were left in place, so
+the next run skips the directories whose listing and kept files didn't change
+and only looks at the new or modified files of the others.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from onlyfiles.core.hash_cache import HASH_CACHE_FILE
+
+# Directories modified this close to their listing may change again within the
+# file system's timestamp granularity, they are listed again on the next run
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+class DirectoryIndex:
+    """
+    Index of directory states, one set of records per organize context.
+
+    The context (e.g. the organize mode and exclusions) tells runs apart whose
+    results would differ for the same directory content.
+
+    Usage example:
+        index = DirectoryIndex()
+        session = index.session('/data/share', 'type')
+        for entry in session.walk(max_depth=None, skip_dir=skip_dir):
+            ...  # Move the entry, or session.keep(entry) if it stays
+        session.commit()
+    """
+
+    def __init__(self, path=HASH_CACHE_FILE):
+        self.path = path
+        self.__db = sqlite3.connect(path)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS directories (
+                                 context TEXT, path TEXT, mtime_ns INTEGER, scanned_ns INTEGER,
+                                 subdirs TEXT NOT NULL, kept TEXT NOT NULL,
+                                 PRIMARY KEY (context, path)
+                             ) WITHOUT ROWID''')
+
+    def session(self, root, context):
+        """Start an incremental walk of root"""
+        return IndexSession(self, root, context)
+
+    def load(self, context, path):
+        """Return (mtime_ns, scanned_ns, subdirs, kept) recorded for a directory, or None"""
+        row = self.__db.execute('SELECT mtime_ns, scanned_ns, subdirs, kept FROM directories WHERE context=? AND path=?',
+                                (context, path)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), json.loads(row[3])
+
+    def save(self, context, records, stale):
+        """Write the (path, mtime_ns, scanned_ns, subdirs, kept) records and forget the stale paths"""
+        with self.__db:
+            self.__db.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(context, path, mtime_ns, scanned_ns, json.dumps(subdirs), json.dumps(kept))
+                                   for path, mtime_ns, scanned_ns, subdirs, kept in records])
+            self.__db.executemany('DELETE FROM directories WHERE context=? AND path=?',
+                                  [(context, path) for path in stale])
+
+    def close(self):
+        """Close the index database"""
+        self.__db.close()
+
+
+class IndexSession:
+    """Incremental walk of a directory tree, recorded into the index by commit"""
+
+    def __init__(self, index, root, context):
+        self.__index = index
+        self.root = root
+        self.context = context
+        self.__skip_dir = None
+        self.__is_excluded = None
+        # Directories listed by this walk: path -> (subfolder names, {kept file name: stat summary})
+        self.__listed = {}
+        self.__stale = []
+        self.skipped = 0  # Number of unchanged directories that weren't listed
+
+    @staticmethod
+    def summary(stat):
+        """Return the stat summary telling whether a file changed"""
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def __is_unchanged(self, path, record, mtime_ns):
+        """Private method to check a record still describes a directory and the files it kept"""
+        if record is None or record[0] != mtime_ns or record[0] + RACY_WINDOW_NS > record[1]:
+            return False
+        # Writing to a file doesn't change the directory, a kept file may now be planned differently
+        for name, summary in record[3].items():
+            try:
+                if self.summary(os.stat(os.path.join(path, name))) != summary:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def walk(self, max_depth=None, skip_dir=None, is_excluded=None, onerror=None):
+        """
+        Lazily yield the os.DirEntry objects of the new or changed files under root.
+
+        Parameters are those of walker.walk_files. Unchanged directories, whose
+        kept files are unchanged too, aren't listed, their recorded subfolders
+        are still visited.
+        """
+        self.__skip_dir = skip_dir
+        self.__is_excluded = is_excluded
+        stack = [(self.root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            record = self.__index.load(self.context, path)
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self.__stale.append(path)
+                continue
+            except OSError as e:
+                if onerror is not None:
+                    onerror(e)
+                continue
+
+            if self.__is_unchanged(path, record, mtime_ns):
+                self.skipped += 1
+                subdirs = record[2]
+                kept = None
+            else:
+                subdirs = []
+                kept = {}
+                self.__listed[path] = (subdirs, kept)
+                known = record[3] if record is not None else {}
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if is_excluded is not None and is_excluded(entry.path):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                if skip_dir is None or not skip_dir(entry):
+                                    subdirs.append(entry.name)
+                            elif entry.is_file():
+                                summary = self.summary(entry.stat())
+                                if known.get(entry.name) == summary:
+                                    kept[entry.name] = summary  # Left in place by an earlier run
+                                else:
+                                    yield entry
+                except OSError as e:
+                    del self.__listed[path]
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+
+            if max_depth is None or depth < max_depth:
+                for name in reversed(subdirs):
+                    stack.append((os.path.join(path, name), depth + 1))
+
+    def keep(self, entry):
+        """Record that a file yielded by walk stays where it is"""
+        self.__listed[os.path.dirname(entry.path)][1][entry.name] = self.summary(entry.stat())
+
+    def commit(self):
+        """
+        Record the listed directories whose content is fully known after the run.
+
+        A directory is recorded only if it holds nothing but its listed subfolders, the
+        folders skipped by the walk and the kept files, so files that failed to move or
+        arrived during the run are looked at again next time.
+        """
+        records = []
+        stale = list(self.__stale)
+        for path, (subdirs, kept) in self.__listed.items():
+            scanned_ns = time.time_ns()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                known = True
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if self.__is_excluded is not None and self.__is_excluded(entry.path):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.__skip_dir is None or not self.__skip_dir(entry):
+                                known = known and entry.name in subdirs
+                        elif entry.is_file():
+                            known = known and entry.name in kept
+                        if not known:
+                            break
+            except OSError:
+                known = False
+
+            if known:
+                records.append((path, mtime_ns, scanned_ns, subdirs, kept))
+            else:
+                stale.append(path)
+        self.__index.save(self.context, records, stale)
@@ -0,0 +1,101 @@
+"""
+Duplicate file finder.
+Files are grouped by size first, then by a hash of their first bytes, and
+only the files still matching are hashed in full, so most files are never
+read completely.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from onlyfiles.core.backup_store import hash_file
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+# Number of bytes hashed in the partial hashing stage
+PARTIAL_HASH_SIZE = 16 * 1024
+
+# Category folder the duplicates are moved to
+DUPLICATES_DIR = 'Duplicates'
+
+
+def partial_hash(path, size=PARTIAL_HASH_SIZE):
+    """Return the SHA-256 hex digest of the first size bytes of a file"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(size)).hexdigest()
+
+
+def _regroup(groups, key, max_workers):
+    """Split each group of paths by key(path) computed in parallel, keep groups with several paths"""
+    paths = [path for group in groups for path in group]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        # Files that can't be read are left out of the comparison
+        keys = pool.map(lambda path: _safe_key(key, path), paths)
+
+        result = []
+        for group in groups:
+            buckets = {}
+            for path in group:
+                value = next(keys)
+                if value is not None:
+                    buckets.setdefault(value, []).append(path)
+            result.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+    return result
+
+
+def _safe_key(key, path):
+    """Return key(path), or None if the file can't be read"""
+    try:
+        return key(path)
+    except OSError:
+        return None
+
+
+def find_duplicates(entries, max_workers=DEFAULT_WORKERS, full_hash=hash_file):
+    """
+    Return the groups of files with identical content.
+
+    Parameters:
+    entries (iterable): os.DirEntry objects of the files to compare
+    max_workers (int): Number of files hashed concurrently
+    full_hash (callable): Called with a path, returns the hash of the whole file
+
+    Returns:
+    list: Groups of paths sorted by path, each holding two or more identical files
+    """
+    by_size = {}
+    # Paths of every inode, hardlinks are the same file and are read once
+    links = {}
+    inodes = {}
+    for entry in entries:
+        stat = entry.stat()
+        # Empty files are all identical and waste no space
+        if stat.st_size == 0:
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in links:
+            links[inode].append(entry.path)
+            continue
+        links[inode] = [entry.path]
+        inodes[entry.path] = inode
+        by_size.setdefault(stat.st_size, []).append(entry.path)
+
+    # Files no larger than the partial hash are fully compared by it
+    small = [group for size, group in by_size.items() if len(group) > 1 and size <= PARTIAL_HASH_SIZE]
+    large = [group for size, group in by_size.items() if len(group) > 1 and size > PARTIAL_HASH_SIZE]
+
+    groups = _regroup(small, partial_hash, max_workers)
+    groups += _regroup(_regroup(large, partial_hash, max_workers), full_hash, max_workers)
+    return sorted(sorted(path for first in group for path in links[inodes[first]]) for group in groups)
+
+
+def wasted_bytes(groups):
+    """Return the number of bytes taken by the extra copies of the duplicate groups"""
+    wasted = 0
+    for group in groups:
+        inodes = set()
+        for path in group:
+            stat = os.stat(path)
+            inodes.add((stat.st_dev, stat.st_ino))
+        wasted += stat.st_size * (len(inodes) - 1)
+    return wasted
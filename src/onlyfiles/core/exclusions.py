@@ -0,0 +1,92 @@
+"""
+Compiled index of the paths excluded from operations.
+Excluded directories are stored in a trie of path components and excluded
+file names in a set plus one compiled pattern for the globs, so checking a
+path costs work proportional to its depth, whatever the number of exclusions.
+"""
+
+import fnmatch
+import os
+import re
+
+# Wildcards making an excluded name a glob pattern, a lone "[" is taken literally
+_GLOB_CHARS = re.compile(r'[*?]')
+
+# Trie key marking an excluded directory, never a path component
+_EXCLUDED = ''
+
+
+class ExclusionIndex:
+    """
+    Excluded directories and file names.
+
+    A directory excludes itself and everything below it, a file name
+    (or glob pattern such as "*.tmp") excludes every entry with that name.
+
+    Usage example:
+        exclusions = ExclusionIndex()
+        exclusions.add_directory('/data/logs')
+        exclusions.add_name('*.part')
+        exclusions.is_excluded('/data/logs2/a.txt')  # False
+    """
+
+    def __init__(self):
+        self.__trie = {}
+        self.__directories = set()
+        self.__names = set()
+        self.__patterns = []
+        self.__pattern = None
+
+    @staticmethod
+    def __components(path):
+        """Private method to return the components of an absolute, normalized path"""
+        return [part for part in os.path.normcase(os.path.abspath(path)).split(os.sep) if part]
+
+    def add_directory(self, directory):
+        """Exclude a directory and its content, return False if it was already excluded"""
+        components = self.__components(directory)
+        key = tuple(components)
+        if key in self.__directories:
+            return False
+        self.__directories.add(key)
+        node = self.__trie
+        for part in components:
+            node = node.setdefault(part, {})
+        node[_EXCLUDED] = True
+        return True
+
+    def add_name(self, name):
+        """Exclude every entry with this name or matching this glob pattern, return False if it was already excluded"""
+        if name in self.__names:
+            return False
+        # The name itself is always excluded, also when it reads as a pattern such as "photo[1].jpg"
+        self.__names.add(name)
+        if _GLOB_CHARS.search(name):
+            self.__patterns.append(name)
+            # All patterns are matched by a single compiled expression
+            self.__pattern = re.compile('|'.join(fnmatch.translate(os.path.normcase(pattern)) for pattern in self.__patterns))
+        return True
+
+    def key(self):
+        """Return a value identifying the exclusions, equal for equal sets of exclusions"""
+        return (tuple(sorted(self.__names)), tuple(sorted(self.__patterns)), tuple(sorted(self.__directories)))
+
+    def is_excluded(self, path):
+        """Check if a file or directory should be excluded from operations"""
+        name = os.path.basename(path)
+        if name in self.__names:
+            return True
+        if self.__pattern is not None and self.__pattern.match(os.path.normcase(name)):
+            return True
+
+        if not self.__trie:
+            return False
+        # Whole components are compared, "/data/logs" doesn't exclude "/data/logs2"
+        node = self.__trie
+        for part in self.__components(path):
+            node = node.get(part)
+            if node is None:
+                return False
+            if _EXCLUDED in node:
+                return True
+        return False
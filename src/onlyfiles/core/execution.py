@@ -2,13 +2,16 @@ import os
 from onlyfiles.utils.logger import Logger
 from onlyfiles.core.file_manager import FileManager
 from onlyfiles.core.file_types import file_types
+from onlyfiles.core.mover import DEFAULT_WORKERS
 
 class Execution:
     """Class that executes and organizes the FileManager class"""
 
-    def __init__(self, logger):
+    def __init__(self, logger, max_workers=DEFAULT_WORKERS, summary=False, sniff=False, incremental=False, journal=None,
+                 stats=None):
         self.__logger = logger
-        self.__filemanager = FileManager(self.__logger)
+        self.__filemanager = FileManager(self.__logger, max_workers, journal=journal, summary=summary, sniff=sniff,
+                                         incremental=incremental, stats=stats)
         self.__types = file_types
 
     def __organize_by_type(self, origin_path, category):
@@ -34,10 +37,9 @@ class Execution:
     def organize_others(self, origin_path):
         self.__organize_by_type(origin_path, 'Others')
 
-    def organize_all(self, origin_path):
-        """Organize all file types"""
-        for category in self.__types.keys():
-            self.__organize_by_type(origin_path, category)
+    def organize_all(self, origin_path, recursive=False, max_depth=None):
+        """Organize all file types in a single pass over the directory"""
+        return self.__filemanager.move_files_by_category(origin_path, self.__types, recursive, max_depth)
 
 if __name__ == '__main__':
     verbose = input('Enable movement operations ("Y for yes" or "N for no": ')
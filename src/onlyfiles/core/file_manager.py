@@ -3,43 +3,134 @@ import os
 import shutil
 from onlyfiles.utils.logger import Logger
 from onlyfiles.core.file_types import file_types
+from onlyfiles.core.type_index import get_type_index
+from onlyfiles.core.walker import walk_files
+from onlyfiles.core.exclusions import ExclusionIndex
+from onlyfiles.core.mover import MoveExecutor, DEFAULT_WORKERS
+from onlyfiles.core.copier import CopyEngine, move_file
+from onlyfiles.core.planner import MovePlan
+from onlyfiles.core.journal import Journal
+from onlyfiles.core.duplicates import find_duplicates, wasted_bytes, DUPLICATES_DIR
+from onlyfiles.utils.log_reader import read_log_lines_reversed
+from onlyfiles.core.backup import (is_backup_name, list_backups, new_backup_name, backup_timestamp, create_snapshot,
+                                  snapshot_manifest, restore_tree)
+from onlyfiles.core.backup_store import BackupStore, STORE_DIR, hash_file
+from onlyfiles.core.hash_cache import HashCache
+from onlyfiles.core.sniffer import ContentSniffer, typed_name
+from onlyfiles.core.dir_index import DirectoryIndex
+from onlyfiles.core.watcher import open_watcher, PendingFiles, DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE
+from onlyfiles.core.stats import NULL_STATS
 from datetime import datetime
+from operator import methodcaller
+import itertools
 import time
+import re
+import weakref
+
+# Backup modes of create_backup: hardlinked snapshot folders or the content-addressed store
+BACKUP_MODES = ("snapshot", "store")
+
+# Organize modes of watch
+WATCH_MODES = ("type", "extension", "date", "size")
+
+# Actions on the duplicate files found: report them, replace them with hardlinks or move them aside
+DUPLICATE_ACTIONS = ("report", "link", "move")
+
+# Folder names created by organize_by_size and organize_by_date
+SIZE_DIRS = ("tiny", "small", "medium", "large", "huge")
+DATE_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
 class FileManager:
 
-    def __init__(self, logger):
+    def __init__(self, logger, max_workers=DEFAULT_WORKERS, journal=None, summary=False, hash_cache=None, sniff=False,
+                 incremental=False, stats=None):
         self.__logger = logger
+        # Per-phase timing, see core.stats; disabled statistics hand the untimed functions back
+        self.__stats = stats if stats is not None else NULL_STATS
+        self.__max_workers = max_workers
+        # Log per-category totals at the end of a run instead of one line per moved file
+        self.__summary = summary
+        self.__executor = None
+        self.__journal = journal or Journal()
+        self.__transaction = None
+        self.__hash_cache = hash_cache  # Opened on first use
+        self.move_results = []  # Per-file results of the last move run
+        self.restore_report = None  # Changes made by the last backup revert
         self.__types = file_types
-        self.__excluded_files = [os.path.basename(Logger.LOG_FILE)]  # Exclude the log file carts operations
-        self.__excluded_dirs = []
+        self.__type_index = get_type_index(self.__types)
+        # Excluded directories and file names, compiled for lookups proportional to the path depth
+        self.__exclusions = ExclusionIndex()
+        self.__exclusions.add_name(os.path.basename(Logger.LOG_FILE))  # Exclude the log file and backup store from operations
+        self.__exclusions.add_name(STORE_DIR)
+        self.__excluded = self.__stats.wrap('exclusions', self.__exclusions.is_excluded)
+        self.__stat = self.__stats.wrap('stat', methodcaller('stat'))
+        # Detect the type of files from their content, not only from their name
+        self.__sniffer = self.__open_sniffer() if sniff else None
+        # Skip the directories unchanged since the last run, see dir_index
+        self.__dir_index = self.__open_dir_index() if incremental else None
+        self.__index_sessions = weakref.WeakKeyDictionary()  # Index session of each plan built incrementally
+
+    def __open_sniffer(self):
+        """Private method to create the content sniffer, caching its results only for this run if the cache can't be opened"""
+        try:
+            return ContentSniffer(self.__max_workers)
+        except Exception as e:
+            self.__logger.warning(f'Sniffing cache unavailable, every file will be read: {str(e)}')
+            return ContentSniffer(self.__max_workers, cache_path=None)
+
+    def __open_dir_index(self):
+        """Private method to open the directory index, None if it can't be opened"""
+        try:
+            return DirectoryIndex()
+        except Exception as e:
+            self.__logger.warning(f'Directory index unavailable, directories will be fully scanned: {str(e)}')
+            return None
+
+    def __index_context(self, mode, settings=None):
+        """Private method to return the index context of a mode, runs with other settings are indexed apart"""
+        return repr((mode, settings, self.__sniffer is not None, self.__exclusions.key()))
+
+    def __walk_for_plan(self, plan, directory, max_depth, skip_dir, settings=None, indexed=True):
+        """Private method to walk the files to plan, only the new or changed ones in incremental mode"""
+        if self.__dir_index is None or not indexed:
+            return self.walk_files(directory, max_depth, skip_dir)
+
+        def onerror(e):
+            self.__stats.count('listing_errors')
+            self.__logger.error(f'Error listing files in {e.filename}: {str(e)}')
+
+        session = self.__dir_index.session(directory, self.__index_context(plan.mode, settings))
+        self.__index_sessions[plan] = session
+        return session.walk(max_depth, skip_dir, self.__excluded, onerror)
+
+    def __keep(self, plan, entry):
+        """Private method to record that a file of an incremental plan stays in place"""
+        session = self.__index_sessions.get(plan)
+        if session is not None:
+            session.keep(entry)
+
+    def __commit_index(self, plan):
+        """Private method to record the directories of an applied incremental plan"""
+        session = self.__index_sessions.pop(plan, None)
+        if session is None:
+            return
+        try:
+            self.__stats.wrap('index', session.commit)()
+            self.__logger.info(f'Skipped {session.skipped} directories of {session.root} unchanged since the last run')
+        except Exception as e:
+            self.__logger.warning(f'Error updating the directory index: {str(e)}')
 
     def add_excluded_directory(self, directory):
-        """Add a directory to the list of directories excluded from move operations"""
-        if os.path.isdir(directory) and directory not in self.__excluded_dirs:
-            self.__excluded_dirs.append(directory)
-            return True
-        return False
+        """Add a directory to the directories excluded from move operations"""
+        return os.path.isdir(directory) and self.__exclusions.add_directory(directory)
 
     def add_excluded_file(self, file_name):
-        """Add a file to the list of files excluded from move operations"""
-        if file_name not in self.__excluded_files:
-            self.__excluded_files.append(file_name)
-            return True
-        return False
+        """Add a file name or glob pattern (e.g. "*.tmp") to the files excluded from move operations"""
+        return self.__exclusions.add_name(file_name)
 
     def __is_excluded(self, file_path):
         """Check if a file or directory should be excluded from operations"""
-        # Check if it is one of the excluded files
-        if os.path.basename(file_path) in self.__excluded_files:
-            return True
-
-        # Check if it is in an excluded directory
-        for excluded_dir in self.__excluded_dirs:
-            if os.path.abspath(file_path).startswith(os.path.abspath(excluded_dir)):
-                return True
-        
-        return False
+        return self.__excluded(file_path)
 
     def list_files(self, origin_path):
         """List files in a directory with UTF-8 encoding"""
@@ -53,6 +144,25 @@ class FileManager:
             self.__logger.error(f'Error listing files in {origin_path}: {str(e)}')
             return []
 
+    def scan_files(self, origin_path, skip_names=()):
+        """Yield directory entries for the files in a directory using a single scandir pass"""
+        try:
+            # UTF-8 handling for path
+            origin_path = origin_path.encode('utf-8').decode('utf-8')
+            with os.scandir(origin_path) as entries:
+                for entry in entries:
+                    # Ignore folders the caller manages itself (e.g. category folders)
+                    if entry.name in skip_names or self.__is_excluded(entry.path):
+                        continue
+
+                    # DirEntry caches the file type from the directory listing, no extra stat needed
+                    if entry.is_file():
+                        yield entry
+                    else:
+                        print(f'"{entry.name}" is not a file, ignoring.')
+        except Exception as e:
+            self.__logger.error(f'Error listing files in {origin_path}: {str(e)}')
+
     def __validate_paths(self, origin_path, destination_path):
         """Private method to validate source and destination paths"""
         try:
@@ -63,312 +173,698 @@ class FileManager:
             if not os.path.exists(origin_path):
                 raise FileNotFoundError(f"Source path does not exist: {origin_path}")
 
-            # Create destination directory and all parent directories if they don't exist
-            os.makedirs(destination_path, exist_ok=True)
-
+            # The destination directory is created once by apply_plan
             return True
         except Exception as e:
             self.__logger.error(f'Error validating paths: {str(e)}')
             return False
 
-    def __move_file(self, source_path, destination_path, file):
-        """Move a single file with UTF-8 handling"""
+    def __begin_moves(self, on_result, plan):
+        """Private method to start a move run on a concurrent executor, journaled as one transaction"""
         try:
-            source_file = os.path.join(source_path, file)
-            dest_file = os.path.join(destination_path, file)
-
-            # Check if it is an excluded file
-            if self.__is_excluded(source_file):
-                self.__logger.info(f'File "{file}" ignored (in exclusion list).')
-                return False
+            self.__transaction = self.__journal.begin(plan.mode, plan.root)
+        except OSError as e:
+            self.__transaction = None
+            self.__logger.warning(f'Journal unavailable, this run can\'t be undone: {str(e)}')
 
-            # Check if the source file exists
-            if not os.path.exists(source_file):
-                self.__logger.warning(f'File "{file}" not found in {source_path}.')
-                return False
+        transaction = self.__transaction
+        record = self.__stats.wrap('journal', self.__journal.record)
+        on_result = self.__stats.wrap('logging', on_result)
 
-            # Check write permissions in the destination
-            if not os.access(destination_path, os.W_OK):
-                self.__logger.error(f'No write permission in {destination_path}.')
-                return False
+        def on_move(result):
+            if result.success and transaction is not None:
+                record(transaction, result.source, result.destination)
+            on_result(result)
 
-            # UTF-8 handling for full paths
-            source_file = source_file.encode('utf-8').decode('utf-8')
-            dest_file = dest_file.encode('utf-8').decode('utf-8')
+        # Cross-device moves copy through the kernel copy engine
+        self.__executor = MoveExecutor(self.__max_workers, on_move, move=self.__stats.wrap('move', move_file),
+                                       rename=self.__stats.wrap('move', os.rename))
 
-            shutil.move(source_file, dest_file)
-            self.__logger.info(f'File "{file}" moved to folder "{destination_path}".')
-            return True
-        except PermissionError as e:
-            self.__logger.error(f'Permission error moving file {file}: {str(e)}')
-            return False
-        except OSError as e:
-            self.__logger.error(f'System error moving file {file}: {str(e)}')
-            return False
-        except Exception as e:
-            self.__logger.error(f'Error moving file {file}: {str(e)}')
-            return False
+    def __finish_moves(self):
+        """Private method to wait for the moves of the current run and collect their results"""
+        executor, self.__executor = self.__executor, None
+        try:
+            self.move_results = executor.wait()
+        finally:
+            if self.__transaction is not None:
+                self.__journal.end(self.__transaction)
+                self.__transaction = None
+        return all(result.success for result in self.move_results)
+
+    def __log_move_error(self, result):
+        """Private method to log a failed move"""
+        file = os.path.basename(result.source)
+        if isinstance(result.error, FileNotFoundError):
+            self.__logger.warning(f'File "{file}" not found in {os.path.dirname(result.source)}.')
+        elif isinstance(result.error, PermissionError):
+            self.__logger.error(f'Permission error moving file {file}: {str(result.error)}')
+        elif isinstance(result.error, OSError):
+            self.__logger.error(f'System error moving file {file}: {str(result.error)}')
+        else:
+            self.__logger.error(f'Error moving file {file}: {str(result.error)}')
+
+    def __log_moved_to_folder(self, result):
+        """Private method to log the result of a move made by the move_files_* methods"""
+        if result.success:
+            if self.__summary:
+                return
+            self.__logger.info(f'File "{os.path.basename(result.source)}" moved to folder "{os.path.dirname(result.destination)}".')
+        else:
+            self.__log_move_error(result)
+
+    def __log_moved(self, result):
+        """Private method to log the result of a move made by the organize_by_* methods"""
+        if result.success:
+            if self.__summary:
+                return
+            self.__logger.info(f"Moved {os.path.basename(result.source)} to {os.path.dirname(result.destination)}")
+        else:
+            self.__log_move_error(result)
+
+    def __typed_names(self, entries):
+        """Private method to pair each entry with its name, extended with the extension sniffed from its content"""
+        if self.__sniffer is None:
+            return ((entry, entry.name) for entry in entries)
+        # Sniffing reads files in parallel batches pulled from the listing as it streams
+        sniffed = self.__stats.iterate('sniff', self.__sniffer.sniff_entries(entries))
+        return ((entry, typed_name(self.__type_index, entry.name, extension)) for entry, extension in sniffed)
+
+    def __plan_into(self, origin_path, destination_path, accept):
+        """Private method to plan moving the files accepted by accept into a single destination folder"""
+        plan = MovePlan('category', origin_path)
+        # Ignore destination folder if it already exists
+        entries = self.scan_files(origin_path, skip_names=(os.path.basename(destination_path),))
+        accept = self.__stats.wrap('classify', accept)
+        for entry, name in self.__typed_names(self.__stats.iterate('listing', entries)):
+            if accept(name):
+                stat = self.__stat(entry)
+                plan.add(entry.path, os.path.join(destination_path, entry.name), stat.st_size, stat.st_dev)
+        return plan
 
     def move_files_by_type(self, origin_path, destination_path, extensions_list):
         """Move files of specified types to the destination folder"""
         if not self.__validate_paths(origin_path, destination_path):
-            return
-
-        # List all files from source
-        files = self.list_files(origin_path)
-
-        if not files:
-            print("Source folder is empty!")
-            return
-
-        # Get destination folder name to ignore it
-        destination_folder_name = os.path.basename(destination_path)
-
-        # Flag to check if found files of the type
-        found_files = False
-
-        for file in files:
-            # Ignore destination folder if it already exists
-            if file == destination_folder_name:
-                continue
-
-            path_file = os.path.join(origin_path, file)
+            return False
 
-            # Check if it's a file
-            if os.path.isfile(path_file):
-                # Get file extension
-                for ext in extensions_list:
-                    if file.endswith(ext):
-                        # Create folder only if found the first file of the type
-                        if not found_files:
-                            os.makedirs(destination_path, exist_ok=True)
-                            found_files = True
+        # Compiled index for the requested extensions
+        type_index = get_type_index({os.path.basename(destination_path): extensions_list})
 
-                        self.__move_file(origin_path, destination_path, file)
-                        break
-            else:
-                print(f'"{file}" is not a file, ignoring.')
+        plan = self.__plan_into(origin_path, destination_path, lambda name: type_index.match(name) is not None)
+        # The destination folder is only created if files of the type were found
+        return self.apply_plan(plan)
 
     def move_other_files(self, origin_path, destination_path, types_dict):
         """Move files that don't fit into any category to the Others folder"""
         if not self.__validate_paths(origin_path, destination_path):
-            return
-
-        # Create the "Others" folder immediately after path validation
-        try:
-            os.makedirs(destination_path, exist_ok=True)
-        except Exception as e:
-            self.__logger.error(f'Error creating "Others" folder in {destination_path}: {str(e)}')
-            return
-
-        # List all files from source
-        files = self.list_files(origin_path)
+            return False
 
-        if not files:
-            print("Source folder is empty!")
-            return
+        # Compiled index of all known extensions from types_dict
+        type_index = get_type_index(types_dict)
 
-        # Get destination folder name to ignore it
-        destination_folder_name = os.path.basename(destination_path)
+        # If extension is not in any known category
+        plan = self.__plan_into(origin_path, destination_path, lambda name: type_index.match(name) is None)
+        return self.apply_plan(plan)
 
-        # Get all known extensions from types_dict
-        known_extensions = set()
-        for ext_list in types_dict.values():
-            known_extensions.update(ext.lower() for ext in ext_list)
+    def plan_by_category(self, origin_path, types_dict, recursive=False, max_depth=None):
+        """Plan the move of every file to its category folder reading the source directory only once"""
+        # UTF-8 handling for path
+        origin_path = origin_path.encode('utf-8').decode('utf-8')
+        if not os.path.isdir(origin_path):
+            self.__logger.error(f'Error validating paths: Source path does not exist: {origin_path}')
+            return None
 
-        for file in files:
-            # Ignore destination folder if it already exists
-            if file == destination_folder_name:
+        # Compiled index of every known extension and its category
+        type_index = get_type_index(types_dict)
+        fallback = 'Others' if 'Others' in types_dict else None
+
+        plan = MovePlan('category', origin_path)
+        if recursive or self.__dir_index is not None:
+            # Category folders are created inside each folder of the tree and never descended into
+            entries = self.__walk_for_plan(plan, origin_path, max_depth if recursive else 0,
+                                           lambda entry: entry.name in types_dict or self.__skip_backup_entry(entry.name))
+        else:
+            entries = self.scan_files(origin_path, skip_names=types_dict.keys())
+
+        classify = self.__stats.wrap('classify', type_index.classify)
+        for entry, name in self.__typed_names(self.__stats.iterate('listing', entries)):
+            category = classify(name, fallback)
+            if category is None:
+                self.__keep(plan, entry)
                 continue
+            self.__plan_move(plan, entry, category)
+        return plan
 
-            path_file = os.path.join(origin_path, file)
+    def move_files_by_category(self, origin_path, types_dict, recursive=False, max_depth=None):
+        """Move every file to its category folder reading the source directory only once"""
+        plan = self.plan_by_category(origin_path, types_dict, recursive, max_depth)
+        if plan is None:
+            return False
+        if not plan:
+            print("Source folder is empty!" if self.__dir_index is None else "No new files since the last run.")
+            self.__commit_index(plan)
+            return True
+        return self.apply_plan(plan)
+
+    def __plan_move(self, plan, entry, bucket):
+        """Private method to add the move of an entry into a bucket folder next to it"""
+        # Files are organized inside the folder they were found in
+        bucket_dir = os.path.join(os.path.dirname(entry.path), bucket)
+        stat = self.__stat(entry)
+        plan.add(entry.path, os.path.join(bucket_dir, entry.name), stat.st_size, stat.st_dev)
+
+    def __plan(self, mode, directory, bucket_for, is_bucket_dir, recursive=False, max_depth=None, by_name=False,
+               only=None, settings=None, indexed=True):
+        """
+        Private method to plan moving every file into the bucket folder chosen by bucket_for.
+
+        bucket_for is called with the entry and its name, which for by_name modes is extended
+        with the extension sniffed from the file content when sniffing is enabled. is_bucket_dir
+        is called with the entry of each subfolder, bucket folders aren't walked. With only,
+        the files whose path isn't in this set are left out. settings tells apart the directory
+        index records of runs of the mode, and indexed=False walks every directory.
+        """
+        try:
+            # UTF-8 handling for directory
+            directory = directory.encode('utf-8').decode('utf-8')
 
-            # Check if it's a file
-            if os.path.isfile(path_file):
-                # Get file extension
-                _, ext = os.path.splitext(file)
+            # Backups and moved duplicates keep the layout they were taken with
+            def skip_dir(entry):
+                return is_bucket_dir(entry) or self.__skip_backup_entry(entry.name) or entry.name == DUPLICATES_DIR
+
+            plan = MovePlan(mode, directory)
+            depth = max_depth if recursive else 0
+            entries = self.__stats.iterate('listing', self.__walk_for_plan(plan, directory, depth, skip_dir, settings,
+                                                                           indexed))
+            bucket_for = self.__stats.wrap('classify', bucket_for)
+            if only is not None:
+                entries = (entry for entry in entries if entry.path in only)
+            named = self.__typed_names(entries) if by_name else ((entry, entry.name) for entry in entries)
+            for entry, name in named:
+                bucket = bucket_for(entry, name)
+                if bucket:
+                    self.__plan_move(plan, entry, bucket)
+                else:
+                    self.__keep(plan, entry)
+            return plan
+        except Exception as e:
+            self.__logger.error(f"Error organizing by {mode}: {str(e)}")
+            return None
 
-                # If extension is not in any known category
-                if ext.lower() not in known_extensions:
-                    self.__move_file(origin_path, destination_path, file)
+    def __create_directories(self, plan):
+        """Private method to create the destination folders of a plan, return the ones that failed"""
+        # Folders known to exist: the source folders of the plan and the ones created here
+        known_dirs = {os.path.dirname(move.source) for move in plan}
+        failed_dirs = set()
+        mkdir = self.__stats.wrap('mkdir', os.mkdir)
+        makedirs = self.__stats.wrap('mkdir', os.makedirs)
+        for directory in plan.directories():
+            if directory in known_dirs:
+                continue
+            try:
+                if os.path.dirname(directory) in known_dirs:
+                    # The parent exists, a single mkdir is enough
+                    try:
+                        mkdir(directory)
+                    except FileExistsError:
+                        if not os.path.isdir(directory):
+                            raise
+                else:
+                    makedirs(directory, exist_ok=True)
+                known_dirs.add(directory)
+            except Exception as e:
+                self.__logger.error(f'Error creating "{os.path.basename(directory)}" folder in {os.path.dirname(directory)}: {str(e)}')
+                failed_dirs.add(directory)
+        return failed_dirs
+
+    def __check_capacity(self, plan):
+        """Private method to check that every destination device has room for the copies of a plan"""
+        # Only cross-device moves copy data, renames need no space
+        devices = {}
+        required = {}
+        for move in plan:
+            directory = os.path.dirname(move.destination)
+            if directory not in devices:
+                devices[directory] = os.stat(directory).st_dev
+            device = devices[directory]
+            if device != move.device:
+                required.setdefault(device, [directory, 0])[1] += move.size
+
+        for directory, size in required.values():
+            free = shutil.disk_usage(directory).free
+            if size > free:
+                self.__logger.error(f'Not enough space in {directory}: {size} bytes required, {free} bytes free.')
+                return False
+        return True
+
+    def __log_summary(self, moves, elapsed):
+        """Private method to log the per-category totals and throughput of a run"""
+        totals = {}
+        failed = 0
+        for move, result in zip(moves, self.move_results):
+            if result.success:
+                total = totals.setdefault(os.path.basename(os.path.dirname(move.destination)), [0, 0])
+                total[0] += 1
+                total[1] += move.size
+            else:
+                failed += 1
+
+        for category, (files, size) in sorted(totals.items()):
+            self.__logger.info(f'{category}: {files} files, {size} bytes')
+
+        files = sum(total[0] for total in totals.values())
+        size = sum(total[1] for total in totals.values())
+        elapsed = max(elapsed, 1e-9)
+        self.__logger.info(f'Organized {files} files ({size} bytes) in {elapsed:.2f}s: '
+                           f'{files / elapsed:.0f} files/s, {size / elapsed / (1024 * 1024):.1f} MB/s, {failed} failed')
+
+    def __count_moves(self, plan, moves):
+        """Private method to add the files and bytes moved by a run to its statistics"""
+        self.__stats.count('files_planned', len(plan))
+        for move, result in zip(moves, self.move_results):
+            if result.success:
+                self.__stats.count('files_moved')
+                self.__stats.count('bytes_moved', move.size)
             else:
-                print(f'"{file}" is not a file, ignoring.')
+                self.__stats.count('move_errors')
 
-    def organize_by_extension(self, directory):
-        """Organize files by their extensions"""
+    def apply_plan(self, plan):
+        """Execute the moves of a plan, return True if every move succeeded"""
+        on_result = self.__log_moved_to_folder if plan.mode == 'category' else self.__log_moved
         try:
-            # UTF-8 handling for directory
-            directory = directory.encode('utf-8').decode('utf-8')
+            # Create every destination folder once, before the first move
+            failed_dirs = self.__create_directories(plan)
+            self.__stats.count('mkdir_errors', len(failed_dirs))
 
-            files = os.listdir(directory)
-            for file in files:
-                file_path = os.path.join(directory, file)
-
-                # Ignore excluded files and directories
-                if self.__is_excluded(file_path) or not os.path.isfile(file_path):
-                    continue
-
-                ext = os.path.splitext(file)[1].lower()
-                if ext:  # Ignore files without extension
-                    ext_dir = os.path.join(directory, ext[1:])  # Remove the dot from extension
-                    os.makedirs(ext_dir, exist_ok=True)
-                    shutil.move(
-                        os.path.join(directory, file),
-                        os.path.join(ext_dir, file)
-                    )
-                    self.__logger.info(f"Moved {file} to {ext_dir}")
-            return True
+            check_capacity = self.__stats.wrap('capacity', self.__check_capacity)
+            if not check_capacity(move for move in plan if os.path.dirname(move.destination) not in failed_dirs):
+                return False
+
+            start = time.monotonic()
+            submitted = []
+            keep_submitted = self.__summary or self.__stats.enabled
+            self.__begin_moves(on_result, plan)
+            for move in plan:
+                if os.path.dirname(move.destination) not in failed_dirs:
+                    self.__executor.submit(move.source, move.destination)
+                    if keep_submitted:
+                        submitted.append(move)
+            success = self.__finish_moves() and not failed_dirs
+
+            if self.__stats.enabled:
+                self.__count_moves(plan, submitted)
+            if self.__summary:
+                self.__stats.wrap('logging', self.__log_summary)(submitted, time.monotonic() - start)
+            self.__commit_index(plan)
+            return success
         except Exception as e:
-            self.__logger.error(f"Error organizing by extension: {str(e)}")
+            self.__logger.error(f"Error organizing by {plan.mode}: {str(e)}")
+            if self.__executor is not None:
+                self.__finish_moves()
             return False
 
-    def organize_by_date(self, directory):
-        """Organize files by their creation date"""
+    def walk_files(self, directory, max_depth=None, skip_dir=None):
+        """Lazily yield the file entries of a directory tree, ignoring excluded paths"""
+        def onerror(e):
+            self.__stats.count('listing_errors')
+            self.__logger.error(f'Error listing files in {e.filename}: {str(e)}')
+
+        return walk_files(directory, max_depth, skip_dir, self.__excluded, onerror)
+
+    def __holds_bucket(self, directory, bucket_for, bucket):
+        """Private method to check that a folder holds files and that all of them belong in bucket"""
+        found = False
+        others = []
         try:
-            # UTF-8 handling for directory
-            directory = directory.encode('utf-8').decode('utf-8')
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        found = True
+                        if bucket_for(entry, entry.name) != bucket:
+                            others.append(entry)
+        except OSError:
+            return False
+        if not others:
+            return found
+        # Files whose name doesn't tell may still belong in it by their sniffed content
+        return self.__sniffer is not None and all(bucket_for(entry, name) == bucket
+                                                  for entry, name in self.__typed_names(others))
+
+    def plan_by_extension(self, directory, recursive=False, max_depth=None, only=None):
+        """Plan organizing files by their extensions"""
+        def bucket_for(entry, name):
+            ext = self.__type_index.suffix(name)
+            return ext[1:]  # Remove the dot from extension, files without extension are ignored
+
+        def is_bucket_dir(entry):
+            # Extension folders are lowercased suffixes holding only files with that suffix
+            name = entry.name
+            return name == name.lower() and self.__holds_bucket(entry.path, bucket_for, name)
+
+        return self.__plan("extension", directory, bucket_for, is_bucket_dir, recursive, max_depth, by_name=True,
+                           only=only)
+
+    def organize_by_extension(self, directory, recursive=False, max_depth=None):
+        """Organize files by their extensions"""
+        plan = self.plan_by_extension(directory, recursive, max_depth)
+        return plan is not None and self.apply_plan(plan)
 
-            files = os.listdir(directory)
-            for file in files:
-                file_path = os.path.join(directory, file)
+    def plan_by_date(self, directory, recursive=False, max_depth=None, only=None):
+        """Plan organizing files by their creation date"""
+        def bucket_for(entry, name):
+            return datetime.fromtimestamp(self.__stat(entry).st_ctime).strftime('%Y-%m-%d')
 
-                # Ignore excluded files and directories
-                if self.__is_excluded(file_path) or not os.path.isfile(file_path):
-                    continue
+        def is_bucket_dir(entry):
+            return DATE_DIR_PATTERN.match(entry.name) is not None
 
-                creation_time = os.path.getctime(file_path)
-                date_str = datetime.fromtimestamp(creation_time).strftime('%Y-%m-%d')
-                date_dir = os.path.join(directory, date_str)
-                os.makedirs(date_dir, exist_ok=True)
-                shutil.move(file_path, os.path.join(date_dir, file))
-                self.__logger.info(f"Moved {file} to {date_dir}")
-            return True
-        except Exception as e:
-            self.__logger.error(f"Error organizing by date: {str(e)}")
-            return False
+        return self.__plan("date", directory, bucket_for, is_bucket_dir, recursive, max_depth, only=only)
 
-    def organize_by_size(self, directory):
+    def organize_by_date(self, directory, recursive=False, max_depth=None):
+        """Organize files by their creation date"""
+        plan = self.plan_by_date(directory, recursive, max_depth)
+        return plan is not None and self.apply_plan(plan)
+
+    @staticmethod
+    def size_category(size_bytes):
+        """Return the size folder name for a file size in bytes"""
+        if size_bytes < 1024:  # Less than 1KB
+            return "tiny"
+        elif size_bytes < 1024 * 1024:  # Less than 1MB
+            return "small"
+        elif size_bytes < 1024 * 1024 * 10:  # Less than 10MB
+            return "medium"
+        elif size_bytes < 1024 * 1024 * 100:  # Less than 100MB
+            return "large"
+        return "huge"
+
+    def plan_by_size(self, directory, recursive=False, max_depth=None, only=None):
+        """Plan organizing files by their size"""
+        def bucket_for(entry, name):
+            return self.size_category(self.__stat(entry).st_size)
+
+        def is_bucket_dir(entry):
+            return entry.name in SIZE_DIRS
+
+        return self.__plan("size", directory, bucket_for, is_bucket_dir, recursive, max_depth, only=only)
+
+    def organize_by_size(self, directory, recursive=False, max_depth=None):
         """Organize files by their size"""
-        try:
-            # UTF-8 handling for directory
-            directory = directory.encode('utf-8').decode('utf-8')
+        plan = self.plan_by_size(directory, recursive, max_depth)
+        return plan is not None and self.apply_plan(plan)
 
-            files = os.listdir(directory)
-            for file in files:
-                file_path = os.path.join(directory, file)
-
-                # Ignore excluded files and directories
-                if self.__is_excluded(file_path) or not os.path.isfile(file_path):
-                    continue
-
-                size_bytes = os.path.getsize(file_path)
-
-                # Convert to appropriate size category
-                if size_bytes < 1024:  # Less than 1KB
-                    size_dir = "tiny"
-                elif size_bytes < 1024 * 1024:  # Less than 1MB
-                    size_dir = "small"
-                elif size_bytes < 1024 * 1024 * 10:  # Less than 10MB
-                    size_dir = "medium"
-                elif size_bytes < 1024 * 1024 * 100:  # Less than 100MB
-                    size_dir = "large"
-                else:
-                    size_dir = "huge"
+    def plan_by_type(self, directory, recursive=False, max_depth=None, only=None):
+        """Plan organizing files by their type (e.g., documents, images, videos, etc.)"""
+        def bucket_for(entry, name):
+            # Determine file type based on extension, "others" by default
+            return self.__type_index.classify(name, "others")
 
-                size_dir_path = os.path.join(directory, size_dir)
-                os.makedirs(size_dir_path, exist_ok=True)
-                shutil.move(file_path, os.path.join(size_dir_path, file))
-                self.__logger.info(f"Moved {file} to {size_dir_path}")
-            return True
-        except Exception as e:
-            self.__logger.error(f"Error organizing by size: {str(e)}")
-            return False
+        def is_bucket_dir(entry):
+            # Category folders hold only files of that category, e.g. not a user "Music" folder of albums
+            name = entry.name
+            return (name in self.__types or name == "others") and self.__holds_bucket(entry.path, bucket_for, name)
+
+        return self.__plan("type", directory, bucket_for, is_bucket_dir, recursive, max_depth, by_name=True,
+                           only=only)
 
-    def organize_by_type(self, directory):
+    def organize_by_type(self, directory, recursive=False, max_depth=None):
         """Organize files by their type (e.g., documents, images, videos, etc.)"""
+        plan = self.plan_by_type(directory, recursive, max_depth)
+        return plan is not None and self.apply_plan(plan)
+
+    def __file_hasher(self):
+        """Private method to return the file hash function, reading through the persistent hash cache"""
+        if self.__hash_cache is None:
+            try:
+                self.__hash_cache = HashCache()
+            except Exception as e:
+                self.__logger.warning(f'Hash cache unavailable, every file will be read: {str(e)}')
+                return hash_file
+        return self.__hash_cache.hash_file
+
+    def __flush_hash_cache(self):
+        """Private method to save the hashes computed by an operation"""
+        if self.__hash_cache is not None:
+            try:
+                self.__hash_cache.flush()
+            except Exception as e:
+                self.__logger.warning(f'Error saving the hash cache: {str(e)}')
+
+    def find_duplicates(self, directory, recursive=False, max_depth=None):
+        """Return the groups of identical files of a directory, each sorted by path, or None on error"""
         try:
             # UTF-8 handling for directory
             directory = directory.encode('utf-8').decode('utf-8')
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f"Source path does not exist: {directory}")
+
+            def skip_dir(entry):
+                # Duplicates already set aside and backup copies aren't compared
+                return entry.name == DUPLICATES_DIR or self.__skip_backup_entry(entry.name)
+
+            depth = max_depth if recursive else 0
+            entries = self.__stats.iterate('listing', self.walk_files(directory, depth, skip_dir))
+            groups = find_duplicates(entries, self.__max_workers, self.__stats.wrap('hash', self.__file_hasher()))
+            if self.__hash_cache is not None:
+                # Forget the files of the directory that were deleted or modified since they were hashed
+                self.__hash_cache.evict(directory)
+            self.__logger.info(f"Found {len(groups)} groups of duplicate files in {directory} ({wasted_bytes(groups)} bytes wasted)")
+            return groups
+        except Exception as e:
+            self.__logger.error(f"Error finding duplicates: {str(e)}")
+            return None
+        finally:
+            self.__flush_hash_cache()
+
+    def __extra_copies(self, group):
+        """Private method to return the files of a duplicate group that aren't hardlinks of its first file"""
+        original = os.stat(group[0])
+        return [path for path in group[1:] if not os.path.samestat(os.stat(path), original)]
+
+    def plan_duplicates(self, directory, groups):
+        """Plan moving every file of the duplicate groups but the first into the Duplicates folder"""
+        plan = MovePlan('duplicates', directory)
+        duplicates_dir = os.path.join(directory, DUPLICATES_DIR)
+        taken = set(os.listdir(duplicates_dir)) if os.path.isdir(duplicates_dir) else set()
+        for group in groups:
+            for path in self.__extra_copies(group):
+                # Copies from different folders often share their name
+                name = os.path.basename(path)
+                stem, ext = os.path.splitext(name)
+                counter = 1
+                while name in taken:
+                    counter += 1
+                    name = f"{stem} ({counter}){ext}"
+                taken.add(name)
+                stat = os.stat(path)
+                plan.add(path, os.path.join(duplicates_dir, name), stat.st_size, stat.st_dev)
+        return plan
+
+    def move_duplicates(self, directory, recursive=False, max_depth=None):
+        """Move the duplicate files of a directory into its Duplicates folder, keeping the first of each group"""
+        groups = self.find_duplicates(directory, recursive, max_depth)
+        return groups is not None and self.apply_plan(self.plan_duplicates(directory, groups))
+
+    def link_duplicates(self, groups):
+        """Replace every file of the duplicate groups but the first with a hardlink to the first"""
+        success = True
+        for group in groups:
+            original = group[0]
+            for path in self.__extra_copies(group):
+                temporary = f"{path}.onlyfiles-link"
+                try:
+                    # Link next to the duplicate then swap it in, the duplicate is never missing
+                    os.link(original, temporary)
+                    os.replace(temporary, path)
+                    self.__logger.info(f'File "{path}" replaced by a hardlink to "{original}".')
+                except Exception as e:
+                    success = False
+                    self.__logger.error(f'Error linking file {os.path.basename(path)}: {str(e)}')
+                    if os.path.lexists(temporary):
+                        os.unlink(temporary)
+        return success
+
+    def plan_by_rules(self, directory, rules, recursive=False, max_depth=None, only=None):
+        """Plan organizing files with the user-defined rules of a RuleSet, files matching no rule stay in place"""
+        categories = set(self.__types) | {"Others"}
+
+        def bucket_for(entry, name):
+            rule = rules.match(name, lambda: self.__stat(entry))
+            if rule is None:
+                return None
+            category = self.__type_index.classify(name, "Others")
+            return rules.destination(rule, self.__stat(entry), category, self.__type_index.suffix(name))
+
+        def is_bucket_dir(entry):
+            return rules.is_destination_dir(entry.name, categories)
+
+        # Age rules match other files as time goes by, even in unchanged directories
+        return self.__plan("rules", directory, bucket_for, is_bucket_dir, recursive, max_depth, by_name=True,
+                           only=only, settings=rules.key(), indexed=not rules.has_age_checks)
+
+    def organize_by_rules(self, directory, rules, recursive=False, max_depth=None):
+        """Organize files with the user-defined rules of a RuleSet"""
+        plan = self.plan_by_rules(directory, rules, recursive, max_depth)
+        return plan is not None and self.apply_plan(plan)
+
+    def watch(self, directory, mode="type", debounce=DEFAULT_DEBOUNCE, poll_interval=DEFAULT_POLL_INTERVAL,
+              polling=False, stop=None, settle=DEFAULT_SETTLE):
+        """
+        Organize the files dropped into a directory as they arrive.
+
+        Parameters:
+        directory (str): Directory to watch, its subfolders are left alone
+        mode (str): Organize mode, one of WATCH_MODES
+        debounce (float): Seconds a file must stay unchanged before it is organized
+        poll_interval (float): Seconds between two scans when inotify isn't available
+        polling (bool): Scan the directory even if inotify is available
+        stop (threading.Event): Stops the watch when set, otherwise it runs until interrupted
+        settle (float): Seconds a file must keep its size and modification time before a scan takes it as written
+
+        Returns:
+        bool: False if the watch couldn't start or failed
+        """
+        planners = {"type": self.plan_by_type, "extension": self.plan_by_extension,
+                    "date": self.plan_by_date, "size": self.plan_by_size}
+        try:
+            # UTF-8 handling for directory
+            directory = os.path.abspath(directory.encode('utf-8').decode('utf-8'))
+            if mode not in planners:
+                raise ValueError(f"Unknown watch mode: {mode}")
+            watcher = open_watcher(directory, poll_interval, polling, settle)
+        except Exception as e:
+            self.__logger.error(f"Error watching {directory}: {str(e)}")
+            return False
 
-            files = os.listdir(directory)
-            for file in files:
-                file_path = os.path.join(directory, file)
-
-                # Ignore excluded files and directories
-                if self.__is_excluded(file_path) or not os.path.isfile(file_path):
-                    continue
-
-                # Get file extension
-                _, ext = os.path.splitext(file)
-                ext = ext.lower()
-
-                # Determine file type based on extension
-                file_type = "others"  # Default type
-                for type_name, extensions in self.__types.items():
-                    if ext in extensions:
-                        file_type = type_name
-                        break
-
-                # Create type directory and move file
-                type_dir = os.path.join(directory, file_type)
-                os.makedirs(type_dir, exist_ok=True)
-                shutil.move(file_path, os.path.join(type_dir, file))
-                self.__logger.info(f"Moved {file} to {type_dir}")
+        self.__logger.info(f"Watching {directory} with {type(watcher).__name__}, organizing by {mode}")
+        pending = PendingFiles(debounce)
+        # Files already there are organized like new ones
+        for name in watcher.existing():
+            pending.touch(os.path.join(directory, name))
+        try:
+            while stop is None or not stop.is_set():
+                timeout = pending.timeout()
+                if stop is not None:
+                    # Wake up regularly to notice the stop request
+                    timeout = 1.0 if timeout is None else min(timeout, 1.0)
+                for name, closed in watcher.wait(timeout).items():
+                    pending.touch(os.path.join(directory, name), closed)
+
+                ready = pending.ready()
+                if ready:
+                    # The whole burst is organized as a single plan
+                    plan = planners[mode](directory, only=set(ready))
+                    if plan:
+                        self.apply_plan(plan)
+            return True
+        except KeyboardInterrupt:
             return True
         except Exception as e:
-            self.__logger.error(f"Error organizing by type: {str(e)}")
+            self.__logger.error(f"Error watching {directory}: {str(e)}")
             return False
+        finally:
+            watcher.close()
+            self.__logger.info(f"Stopped watching {directory}")
+
+    def __skip_backup_entry(self, name):
+        """Private method to leave earlier backups and the backup store out of a new backup"""
+        return is_backup_name(name) or name == STORE_DIR
 
-    def create_backup(self, directory):
-        """Create a backup of the directory"""
+    def create_backup(self, directory, mode="snapshot"):
+        """
+        Create a backup of the directory.
+
+        The "snapshot" mode creates a backup folder linking files unchanged since the last
+        snapshot, the "store" mode saves the files in the deduplicating backup store.
+        """
         try:
             # UTF-8 handling for directory
             directory = directory.encode('utf-8').decode('utf-8')
 
-            backup_dir = os.path.join(directory, f"backup_{int(time.time())}")
-            shutil.copytree(directory, backup_dir, dirs_exist_ok=True)
-            self.__logger.info(f"Created backup at {backup_dir}")
+            if mode not in BACKUP_MODES:
+                raise ValueError(f"Unknown backup mode: {mode}")
+
+            store = BackupStore(directory, self.__file_hasher() if mode == "store" else hash_file)
+            backups = list_backups(directory)
+            name = new_backup_name(directory, time.time(), taken=set(store.list_backups()))
+
+            if mode == "store":
+                stats = store.create(name, skip=self.__skip_backup_entry)
+                backup_path = store.manifest_path(name)
+                self.__logger.info(f"Created backup at {backup_path} ({stats.stored} files stored, {stats.deduplicated} duplicates)")
+                return backup_path
+
+            # Earlier backups are never part of a new one
+            previous = os.path.join(directory, backups[-1]) if backups else None
+            backup_dir = os.path.join(directory, name)
+            stats = create_snapshot(directory, backup_dir, previous, self.__skip_backup_entry, self.__max_workers)
+            self.__logger.info(f"Created backup at {backup_dir} ({stats.copied} files copied, {stats.linked} unchanged files linked)")
             return backup_dir
         except Exception as e:
             self.__logger.error(f"Error creating backup: {str(e)}")
             return None
+        finally:
+            self.__flush_hash_cache()
 
-    def revert_backup(self, directory):
-        """Revert to the most recent backup"""
+    def revert_backup(self, directory, delete_extra=False, verify=False):
+        """
+        Revert to the most recent backup, from a snapshot folder or the backup store.
+
+        Only files that differ from the backup are copied back. With delete_extra the files
+        created after the backup are deleted, with verify files are also compared by content hash.
+        """
         try:
             # UTF-8 handling for directory
             directory = directory.encode('utf-8').decode('utf-8')
 
             # Find the most recent backup
-            backups = [d for d in os.listdir(directory) if d.startswith("backup_")]
+            file_hash = self.__file_hasher() if verify else hash_file
+            store = BackupStore(directory, file_hash)
+            backups = list_backups(directory) + store.list_backups()
             if not backups:
                 return False
 
-            latest_backup = max(backups, key=lambda x: int(x.split('_')[1]))
+            latest_backup = max(backups, key=backup_timestamp)
             backup_path = os.path.join(directory, latest_backup)
 
-            # Move files from backup to main directory
-            for item in os.listdir(backup_path):
-                if item != latest_backup:  # Don't copy the backup folder itself
-                    src = os.path.join(backup_path, item)
-                    dst = os.path.join(directory, item)
-                    if os.path.isdir(src):
-                        shutil.copytree(src, dst, dirs_exist_ok=True)
-                    else:
-                        shutil.copy2(src, dst)
+            if os.path.isdir(backup_path):
+                engine = CopyEngine(self.__max_workers)
+
+                def write_file(relative, record, destination):
+                    engine.submit(os.path.join(backup_path, relative), destination)
 
-            self.__logger.info(f"Reverted to backup {latest_backup}")
+                def record_hash(relative, record):
+                    return file_hash(os.path.join(backup_path, relative))
+
+                report = restore_tree(directory, snapshot_manifest(backup_path), write_file, delete_extra,
+                                      self.__skip_backup_entry, record_hash if verify else None, file_hash)
+                failed = engine.wait()
+                if failed:
+                    raise failed[0].error
+            else:
+                report = store.restore(latest_backup, directory, delete_extra, self.__skip_backup_entry, verify,
+                                       self.__max_workers)
+
+            self.restore_report = report
+            for relative in report.restored:
+                self.__logger.info(f'Restored "{relative}" from backup {latest_backup}')
+            for relative in report.deleted:
+                self.__logger.info(f'Deleted "{relative}" created after backup {latest_backup}')
+            self.__logger.info(f"Reverted to backup {latest_backup} ({len(report.restored)} restored, "
+                               f"{len(report.deleted)} deleted, {report.unchanged} unchanged)")
             return True
         except Exception as e:
             self.__logger.error(f"Error reverting backup: {str(e)}")
             return False
+        finally:
+            self.__flush_hash_cache()
 
-    def read_logs(self):
-        """Read log file content"""
+    def read_logs(self, limit=None):
+        """Read the lines of the log and its archived segments, only the limit most recent ones when given"""
         try:
             from onlyfiles.utils.logger import Logger
-            with open(Logger.LOG_FILE, 'r', encoding='utf-8') as f:
-                return f.readlines()
+            lines = read_log_lines_reversed(Logger.LOG_FILE)
+            if limit is not None:
+                lines = itertools.islice(lines, limit)
+            return list(reversed(list(lines)))
         except FileNotFoundError:
             self.__logger.warning(f"Log file not found at {Logger.LOG_FILE}")
             return []
@@ -440,63 +936,57 @@ class FileManager:
             self.__logger.error(f'Error reverting operation: {str(e)}')
         return False
 
-    def revert_last_action(self):
-        """Revert the last complete file movement action based on logs"""
+    def __revert_move(self, source, destination):
+        """Private method to move a file back from destination to its source"""
+        filename = os.path.basename(source)
+        parent_dir = os.path.dirname(source)
         try:
-            # Read all logs
-            logs = self.read_logs()
-            if not logs:
-                self.__logger.warning("No logs found for reversion.")
+            if not os.path.lexists(destination):
+                self.__logger.warning(f'File {filename} not found in {os.path.dirname(destination)}')
                 return False
-
-            # Filter move-related logs
-            move_logs = self.get_move_logs(logs)
-            if not move_logs:
-                self.__logger.warning("No move logs found for reversion.")
+            if os.path.lexists(source):
+                self.__logger.warning(f'File "{filename}" already exists in "{parent_dir}", not reverted.')
                 return False
 
-            # Reverse logs to process the most recent first
-            move_logs.reverse()
-
-            # Group logs by action (assuming logs from the same action are consecutive)
-            # We consider logs within a short time window (e.g., 5 seconds) as part of the same action
-            last_action_logs = []
-            last_timestamp = None
-            time_threshold = 5  # Seconds
-
-            for log in move_logs:
-                # Extract timestamp from log (format: 'YYYY-MM-DD HH:MM:SS - name - level - message')
-                try:
-                    timestamp_str = log.split(' - ')[0].strip()
-                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                except (IndexError, ValueError):
-                    continue  # Skip logs with invalid format
-
-                if last_timestamp is None:
-                    last_timestamp = timestamp
-                    last_action_logs.append(log)
-                elif (last_timestamp - timestamp).total_seconds() <= time_threshold:
-                    last_action_logs.append(log)
-                else:
-                    break  # Found a gap, stop grouping
+            os.makedirs(parent_dir, exist_ok=True)
+            move_file(destination, source)
+            self.__logger.info(f'File "{filename}" reverted to "{parent_dir}".')
+            return True
+        except Exception as e:
+            self.__logger.error(f'Error reverting operation: {str(e)}')
+            return False
 
-            if not last_action_logs:
-                self.__logger.warning("No valid logs found for the last action.")
+    def revert_last_action(self):
+        """Revert the last organize run recorded in the transaction journal"""
+        try:
+            transaction = self.__journal.last_transaction()
+            if transaction is None:
+                self.__logger.warning("No journaled action found for reversion.")
+                return False
+            if not transaction.moves:
+                self.__logger.warning("No moves found in the last action.")
+                self.__journal.mark_undone(transaction.id)
                 return False
 
             # Revert each file in the last action in reverse order
-            success = True
-            for log in reversed(last_action_logs):
-                if not self.revert_file(log):
-                    success = False
-                    self.__logger.error(f"Failed to revert part of the last action: {log}")
-
-            if success:
+            failed = []
+            for source, destination in reversed(transaction.moves):
+                if not self.__revert_move(source, destination):
+                    failed.append((source, destination))
+                    self.__logger.error(f'Failed to revert part of the last action: "{destination}"')
+
+            if not failed:
+                # Undo never replays the same transaction twice, the next undo goes one action further back
+                self.__journal.mark_undone(transaction.id)
                 self.__logger.info("Successfully reverted the last action.")
-            else:
-                self.__logger.warning("Last action partially reverted due to errors.")
-            return success
+                return True
+
+            # The moves that failed stay journaled, the next undo retries them
+            failed.reverse()
+            self.__journal.mark_partly_undone(transaction, failed)
+            self.__logger.warning(f"Last action partially reverted due to errors, {len(failed)} moves left for the next undo.")
+            return False
 
         except Exception as e:
             self.__logger.error(f"Error reverting last action: {str(e)}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,137 @@
+"""
+Persistent cache of file content hashes.
+Hashes are stored in a SQLite database next to the operation log, keyed by
+the device, inode, size and modification time of the file, so repeated runs
+over a mostly unchanged tree only read the files that are new or modified.
+"""
+
+import os
+import sqlite3
+import threading
+
+from onlyfiles.utils.logger import Logger
+from onlyfiles.core.backup_store import hash_file
+
+# Default cache database, next to the operation log
+HASH_CACHE_FILE = os.path.join(os.path.dirname(Logger.LOG_FILE), 'hashes.db')
+
+# Version of the database schema
+SCHEMA_VERSION = 1
+
+# Number of new hashes kept in memory before they are written
+FLUSH_INTERVAL = 1000
+
+
+class HashCache:
+    """
+    Content hash cache, safe to use from several threads.
+
+    An entry is only used while the file keeps its (st_dev, st_ino, st_size,
+    st_mtime_ns), any change to the file makes it hashed again.
+
+    Usage example:
+        cache = HashCache()
+        digest = cache.hash_file('/data/a.iso')
+        cache.evict('/data')
+        cache.close()
+    """
+
+    def __init__(self, path=HASH_CACHE_FILE, hasher=hash_file):
+        self.path = path
+        self.__hasher = hasher
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        # Readers don't block the writer and a crash never corrupts the cache
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        if self.__db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.__db.executescript(f'''
+                DROP TABLE IF EXISTS hashes;
+                CREATE TABLE hashes (
+                    dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+                    path TEXT NOT NULL, digest TEXT NOT NULL,
+                    PRIMARY KEY (dev, ino, size, mtime_ns)
+                ) WITHOUT ROWID;
+                CREATE INDEX hashes_path ON hashes (path);
+                PRAGMA user_version = {SCHEMA_VERSION};
+            ''')
+
+    @staticmethod
+    def __key(stat):
+        """Private method to return the cache key of a file"""
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def lookup(self, stat):
+        """Return the cached hash of a file from its os.stat result, or None"""
+        with self.__lock:
+            row = self.__db.execute('SELECT digest FROM hashes WHERE dev=? AND ino=? AND size=? AND mtime_ns=?',
+                                    self.__key(stat)).fetchone()
+        return row[0] if row else None
+
+    def store(self, path, stat, digest):
+        """Cache the hash of a file, stat being the os.stat result it was hashed with"""
+        with self.__lock:
+            self.__pending.append(self.__key(stat) + (os.path.abspath(path), digest))
+            if len(self.__pending) >= FLUSH_INTERVAL:
+                self.__flush()
+
+    def hash_file(self, path):
+        """Return the hash of a file, reading it only if it changed since it was cached"""
+        stat = os.stat(path)
+        digest = self.lookup(stat)
+        if digest is None:
+            digest = self.__hasher(path)
+            # A file modified while it was read is not cached
+            if self.__key(os.stat(path)) == self.__key(stat):
+                self.store(path, stat, digest)
+        return digest
+
+    def __flush(self):
+        """Private method to write the pending hashes, the lock must be held"""
+        if self.__pending:
+            with self.__db:
+                self.__db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)', self.__pending)
+            self.__pending = []
+
+    def flush(self):
+        """Write the hashes computed since the last flush"""
+        with self.__lock:
+            self.__flush()
+
+    def evict(self, directory=None):
+        """Remove the entries of files that are gone or changed, under directory or everywhere, return their number"""
+        with self.__lock:
+            self.__flush()
+            if directory is None:
+                rows = self.__db.execute('SELECT dev, ino, size, mtime_ns, path FROM hashes').fetchall()
+            else:
+                prefix = os.path.join(os.path.abspath(directory), '')
+                # Range scan on the path index instead of a LIKE pattern that would need escaping
+                rows = self.__db.execute('SELECT dev, ino, size, mtime_ns, path FROM hashes WHERE path >= ? AND path < ?',
+                                         (prefix, prefix[:-1] + chr(ord(os.sep) + 1))).fetchall()
+
+        stale = []
+        for row in rows:
+            try:
+                if self.__key(os.stat(row[4])) != row[:4]:
+                    stale.append(row[:4])
+            except OSError:
+                stale.append(row[:4])
+
+        if stale:
+            with self.__lock, self.__db:
+                self.__db.executemany('DELETE FROM hashes WHERE dev=? AND ino=? AND size=? AND mtime_ns=?', stale)
+        return len(stale)
+
+    def close(self):
+        """Write the pending hashes and close the database"""
+        with self.__lock:
+            self.__flush()
+            self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,189 @@
+"""
+Transaction journal of the move runs.
+Every organize run appends its moves as JSON lines tagged with a transaction
+ID, so undo finds the last run by reading the journal backwards and replays
+its moves in reverse without parsing log messages.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from onlyfiles.utils.logger import Logger
+from onlyfiles.utils.log_reader import read_lines_reversed
+
+# Default journal file, next to the operation log
+JOURNAL_FILE = os.path.join(os.path.dirname(Logger.LOG_FILE), 'journal.jsonl')
+
+# Size of the journal above which it is compacted when a transaction starts
+JOURNAL_MAX_BYTES = 10 * 1024 * 1024
+
+# Number of most recent transactions kept by compaction, undone ones are dropped
+JOURNAL_KEEP = 100
+
+
+class Transaction(namedtuple('Transaction', ['id', 'mode', 'root', 'moves'])):
+    """Journaled run, moves holds its (source, destination) pairs in the order they were made"""
+
+    __slots__ = ()
+
+
+class Journal:
+    """
+    Append-only journal of the moves made by each run.
+
+    Records are JSON objects with the transaction ID in "tx" and an "op" of
+    "begin", "move", "end" or "undo".
+
+    Usage example:
+        journal = Journal()
+        tx = journal.begin('type', '/data/inbox')
+        journal.record(tx, '/data/inbox/a.mp3', '/data/inbox/Music/a.mp3')
+        journal.end(tx)
+        last = journal.last_transaction()
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.__lock = threading.Lock()
+        # Open journal file, number of moves and begin record of each running transaction
+        self.__files = {}
+        self.__counts = {}
+        self.__begins = {}
+
+    def __write(self, f, record):
+        """Private method to append a record"""
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def begin(self, mode, root):
+        """Start a transaction and return its ID, nothing is written until its first move"""
+        transaction = uuid.uuid4().hex
+        with self.__lock:
+            if not self.__files:
+                self.__compact_if_large()
+            f = open(self.path, 'a', encoding='utf-8')
+            self.__files[transaction] = f
+            self.__counts[transaction] = 0
+            self.__begins[transaction] = {'tx': transaction, 'op': 'begin', 'mode': mode, 'root': root, 'time': time.time()}
+        return transaction
+
+    def record(self, transaction, source, destination):
+        """Record a move made by a transaction, safe to call from several threads"""
+        with self.__lock:
+            f = self.__files[transaction]
+            begin = self.__begins.pop(transaction, None)
+            if begin is not None:
+                self.__write(f, begin)
+            self.__write(f, {'tx': transaction, 'op': 'move', 'src': source, 'dst': destination})
+            # The move already happened, its record must survive an interrupted run
+            f.flush()
+            self.__counts[transaction] += 1
+
+    def end(self, transaction):
+        """Close a transaction, a transaction without moves leaves no trace"""
+        with self.__lock:
+            f = self.__files.pop(transaction)
+            count = self.__counts.pop(transaction)
+            self.__begins.pop(transaction, None)
+            try:
+                if count:
+                    self.__write(f, {'tx': transaction, 'op': 'end', 'moved': count, 'time': time.time()})
+            finally:
+                f.close()
+
+    def __compact_if_large(self):
+        """Private method to compact the journal once it grew past JOURNAL_MAX_BYTES"""
+        try:
+            if os.path.getsize(self.path) > JOURNAL_MAX_BYTES:
+                self.compact()
+        except OSError:
+            pass  # No journal yet, or it can't be rewritten and keeps growing
+
+    def compact(self, keep=JOURNAL_KEEP):
+        """Rewrite the journal with only the keep most recent transactions that weren't undone"""
+        records = {}
+        undone = set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Line cut short by a crash
+                if record.get('op') == 'undo':
+                    undone.add(record.get('tx'))
+                else:
+                    records.setdefault(record.get('tx'), []).append(record)
+
+        kept = [transaction for transaction in records if transaction not in undone][-keep:] if keep > 0 else []
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for transaction in kept:
+                for record in records[transaction]:
+                    self.__write(f, record)
+        os.replace(temporary, self.path)
+
+    def mark_undone(self, transaction):
+        """Record that a transaction was undone so the next undo goes to the one before it"""
+        with open(self.path, 'a', encoding='utf-8') as f:
+            self.__write(f, {'tx': transaction, 'op': 'undo', 'time': time.time()})
+
+    def mark_partly_undone(self, transaction, remaining):
+        """
+        Record that a transaction was undone except for the remaining (source, destination) moves.
+
+        The remaining moves are journaled again as a new transaction of the same mode and root,
+        so the next undo retries them before going to the transaction before.
+        """
+        retry = uuid.uuid4().hex
+        now = time.time()
+        records = [{'tx': transaction.id, 'op': 'undo', 'time': now},
+                   {'tx': retry, 'op': 'begin', 'mode': transaction.mode, 'root': transaction.root, 'time': now}]
+        records.extend({'tx': retry, 'op': 'move', 'src': source, 'dst': destination} for source, destination in remaining)
+        records.append({'tx': retry, 'op': 'end', 'moved': len(remaining), 'time': now})
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in records:
+                self.__write(f, record)
+
+    def last_transaction(self):
+        """Return the most recent transaction that wasn't undone, or None"""
+        undone = set()
+        current = None
+        moves = []
+        try:
+            for line in read_lines_reversed(self.path):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Line cut short by a crash
+
+                transaction = record.get('tx')
+                op = record.get('op')
+                if op == 'undo':
+                    undone.add(transaction)
+                elif transaction in undone:
+                    continue
+                elif current is None:
+                    current = transaction
+
+                if transaction != current:
+                    continue
+                if op == 'move':
+                    moves.append((record['src'], record['dst']))
+                elif op == 'begin':
+                    if not moves:
+                        # Journals of older versions hold runs that moved nothing
+                        current = None
+                        continue
+                    moves.reverse()
+                    return Transaction(current, record.get('mode'), record.get('root'), moves)
+        except FileNotFoundError:
+            return None
+
+        # The begin record was lost, keep the moves that were journaled
+        if current is None:
+            return None
+        moves.reverse()
+        return Transaction(current, None, None, moves)
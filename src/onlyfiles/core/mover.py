@@ -0,0 +1,168 @@
+"""
+Concurrent file move executor.
+Moves between directories on the same device are plain renames issued in
+batches on the calling thread. Cross-device moves, which are a full copy
+followed by a delete, run on a thread pool so they overlap instead of
+leaving the disks idle.
+"""
+
+import errno
+import os
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Default number of concurrent moves
+DEFAULT_WORKERS = 4
+
+# Number of same-device renames issued together
+RENAME_BATCH_SIZE = 256
+
+
+class MoveResult(namedtuple('MoveResult', ['source', 'destination', 'error'])):
+    """Outcome of a single move, error holds the raised exception when it failed"""
+
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+class MoveExecutor:
+    """
+    Thread-pool executor for file moves.
+
+    The device of each source/destination directory pair is checked once.
+    Same-device moves are batched os.rename calls; cross-device moves run
+    concurrently on up to max_workers threads, or inline with a single
+    worker. Moves into the same destination path always run in submission
+    order.
+
+    Usage example:
+        executor = MoveExecutor(max_workers=8)
+        executor.submit('/data/a.mp3', '/data/Music/a.mp3')
+        results = executor.wait()
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, on_result=None, move=shutil.move, rename=os.rename):
+        self.__max_workers = max(1, max_workers or 1)
+        self.__on_result = on_result
+        self.__move = move
+        self.__rename = rename
+        self.__results = []
+        self.__lock = threading.Lock()
+        # Same-device check for each (source dir, destination dir) pair
+        self.__devices = {}
+        # Pending same-device renames
+        self.__renames = []
+        # Last pending move for each destination, used to chain moves to the same path
+        self.__last = {}
+        self.__pool = None
+        if self.__max_workers > 1:
+            self.__pool = ThreadPoolExecutor(max_workers=self.__max_workers)
+            # Bound the queued moves so streaming callers keep a bounded working set
+            self.__slots = threading.BoundedSemaphore(self.__max_workers * 8)
+
+    @property
+    def max_workers(self):
+        """Return the number of concurrent moves"""
+        return self.__max_workers
+
+    def submit(self, source, destination):
+        """Schedule a move of source to destination"""
+        with self.__lock:
+            index = len(self.__results)
+            self.__results.append(None)
+
+        if self.__same_device(source, destination):
+            self.__renames.append((index, source, destination))
+            if len(self.__renames) >= RENAME_BATCH_SIZE:
+                self.__flush_renames()
+            return
+
+        # Renames submitted earlier go first, keeping the submission order
+        if self.__renames:
+            self.__flush_renames()
+
+        if self.__pool is None:
+            self.__run(index, source, destination, None)
+            return
+
+        self.__slots.acquire()
+        with self.__lock:
+            previous = self.__last.get(destination)
+            future = self.__pool.submit(self.__run, index, source, destination, previous)
+            self.__last[destination] = future
+        future.add_done_callback(lambda f: self.__release(destination, f))
+
+    def __same_device(self, source, destination):
+        """Return True if source and destination directories are on the same device"""
+        pair = (os.path.dirname(source), os.path.dirname(destination))
+        same = self.__devices.get(pair)
+        if same is None:
+            try:
+                same = os.stat(pair[0]).st_dev == os.stat(pair[1]).st_dev
+            except OSError:
+                same = False
+            self.__devices[pair] = same
+        return same
+
+    def __flush_renames(self):
+        """Issue the pending same-device renames"""
+        renames, self.__renames = self.__renames, []
+        for index, source, destination in renames:
+            # Keep the order with a cross-device move to the same path still running
+            with self.__lock:
+                previous = self.__last.get(destination)
+            if previous is not None:
+                wait([previous])
+
+            error = None
+            try:
+                self.__rename(source, destination)
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    # The device changed under us (e.g. a mount point), fall back to a full move
+                    try:
+                        self.__move(source, destination)
+                    except Exception as move_error:
+                        error = move_error
+                else:
+                    error = e
+            self.__record(index, source, destination, error)
+
+    def __record(self, index, source, destination, error):
+        """Store the result of a move and report it"""
+        result = MoveResult(source, destination, error)
+        self.__results[index] = result
+        if self.__on_result is not None:
+            self.__on_result(result)
+
+    def __release(self, destination, future):
+        """Free the queue slot of a finished move"""
+        with self.__lock:
+            if self.__last.get(destination) is future:
+                del self.__last[destination]
+        self.__slots.release()
+
+    def __run(self, index, source, destination, previous):
+        """Execute one move once the previous move to the same destination finished"""
+        if previous is not None:
+            wait([previous])
+
+        error = None
+        try:
+            self.__move(source, destination)
+        except Exception as e:
+            error = e
+        self.__record(index, source, destination, error)
+
+    def wait(self):
+        """Wait for all scheduled moves and return their results in submission order"""
+        self.__flush_renames()
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+            self.__pool = None
+        return list(self.__results)
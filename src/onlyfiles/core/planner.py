@@ -0,0 +1,81 @@
+"""
+Move plans for the organize modes.
+A plan is the full list of moves a run would make, built without touching
+the file system so it can be previewed, exported and applied later.
+"""
+
+import json
+import os
+from collections import namedtuple
+
+# Version of the exported plan format
+PLAN_FORMAT = 1
+
+
+class PlannedMove(namedtuple('PlannedMove', ['source', 'destination', 'size', 'device'])):
+    """Single move of a plan, device is the st_dev of the source file"""
+
+    __slots__ = ()
+
+
+class MovePlan:
+    """
+    Ordered list of moves produced by one organize mode.
+
+    Usage example:
+        plan = file_manager.plan_by_type('/data/inbox')
+        plan.save('/tmp/plan.json')
+        file_manager.apply_plan(MovePlan.load('/tmp/plan.json'))
+    """
+
+    def __init__(self, mode, root, moves=None):
+        self.mode = mode
+        self.root = root
+        self.__moves = list(moves or [])
+
+    def add(self, source, destination, size, device):
+        """Append a move to the plan"""
+        self.__moves.append(PlannedMove(source, destination, size, device))
+
+    def __iter__(self):
+        return iter(self.__moves)
+
+    def __len__(self):
+        return len(self.__moves)
+
+    @property
+    def total_size(self):
+        """Return the number of bytes moved by the plan"""
+        return sum(move.size for move in self.__moves)
+
+    def directories(self):
+        """Return the destination directories of the plan, parents first"""
+        return sorted({os.path.dirname(move.destination) for move in self.__moves})
+
+    def to_dict(self):
+        """Return the plan as a JSON serializable dictionary"""
+        return {
+            'format': PLAN_FORMAT,
+            'mode': self.mode,
+            'root': self.root,
+            # Moves are stored as arrays to keep large plans compact
+            'moves': [list(move) for move in self.__moves],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a plan from a dictionary created by to_dict"""
+        if data.get('format') != PLAN_FORMAT:
+            raise ValueError(f"Unsupported plan format: {data.get('format')}")
+        return cls(data['mode'], data['root'], (PlannedMove(*move) for move in data['moves']))
+
+    def save(self, path):
+        """Write the plan to a JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        """Read a plan written by save"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
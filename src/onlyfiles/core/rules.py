@@ -0,0 +1,350 @@
+"""
+User-defined organize rules.
+Rules are read from a JSON file and compiled once: extension globs and literal
+names become hash lookups, other name patterns are indexed by a literal that
+every matching name contains (or else folded into a single regular expression),
+and the size and age of a file are only checked for the rules whose name
+pattern matched, so classifying a file costs about the same for 5 rules or 500.
+"""
+
+import fnmatch
+import json
+import re
+import string
+import time
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Units of the sizes and ages of the rules, e.g. "10MB" or "30d"
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+AGE_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+QUANTITY_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$')
+
+# Fields of a destination template, e.g. "{category}/{year}/{month}"
+TEMPLATE_FIELDS = ('category', 'year', 'month', 'day', 'ext')
+
+# Folder names a destination field expands to, {category} matches the category folder names
+FIELD_PATTERNS = {'year': r'\d{4}', 'month': r'\d{2}', 'day': r'\d{2}', 'ext': r'[^/.]+'}
+
+# Globs that only test the extension, e.g. "*.jpg" or "*.tar.gz"
+_SUFFIX_GLOB = re.compile(r'^\*(\.[^*?\[\]]+)$')
+_GLOB_CHARS = re.compile(r'[*?[]')
+_WILDCARDS = re.compile(r'[*?]+')
+
+# Length of the keys indexing the literals that pattern rules require in a name
+KEY_LENGTH = 3
+
+
+class Rule(namedtuple('Rule', ['name', 'globs', 'regex', 'min_size', 'max_size', 'min_age', 'max_age', 'destination'])):
+    """Organize rule, sizes are in bytes and ages in seconds, None when not limited"""
+
+    __slots__ = ()
+
+    def matches_stat(self, stat, now):
+        """Return True if the size and age of a file, from its os.stat result, are within the rule's ranges"""
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and stat.st_size > self.max_size:
+            return False
+        if self.min_age is not None or self.max_age is not None:
+            age = now - stat.st_mtime
+            if self.min_age is not None and age < self.min_age:
+                return False
+            if self.max_age is not None and age > self.max_age:
+                return False
+        return True
+
+    @property
+    def has_age_checks(self):
+        """Return True if the rule checks the age of files, its result then changes over time"""
+        return self.min_age is not None or self.max_age is not None
+
+    @property
+    def has_stat_checks(self):
+        """Return True if the rule checks the size or age of files"""
+        return any(value is not None for value in (self.min_size, self.max_size, self.min_age, self.max_age))
+
+
+def parse_quantity(value, units, field):
+    """Return a size or age given as a number or a string such as "10MB" or "30d", in the base unit of units"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    match = QUANTITY_PATTERN.match(str(value))
+    unit = match and next((key for key in units if key.lower() == match.group(2).lower()), None)
+    if unit is None:
+        raise ValueError(f"Invalid {field}: {value}")
+    return float(match.group(1)) * units[unit]
+
+
+def parse_rule(data, index):
+    """Build a Rule from its JSON object, index is its position used in error messages"""
+    if not isinstance(data, dict):
+        raise ValueError(f"Rule {index}: expected an object")
+    unknown = set(data) - {'name', 'glob', 'regex', 'min_size', 'max_size', 'min_age', 'max_age', 'destination'}
+    if unknown:
+        raise ValueError(f"Rule {index}: unknown fields {', '.join(sorted(unknown))}")
+
+    destination = data.get('destination')
+    if not destination or not isinstance(destination, str):
+        raise ValueError(f"Rule {index}: a destination is required")
+    if destination.startswith('/') or '..' in destination.split('/'):
+        raise ValueError(f"Rule {index}: the destination must stay inside the organized folder")
+    for _, field, _, _ in string.Formatter().parse(destination):
+        if field is not None and field not in TEMPLATE_FIELDS:
+            raise ValueError(f"Rule {index}: unknown destination field {{{field}}}")
+
+    globs = data.get('glob') or []
+    if isinstance(globs, str):
+        globs = [globs]
+    regex = data.get('regex')
+    try:
+        if regex is not None:
+            re.compile(regex)
+        return Rule(data.get('name', f'rule {index}'), tuple(globs), regex,
+                    parse_quantity(data.get('min_size'), SIZE_UNITS, 'min_size'),
+                    parse_quantity(data.get('max_size'), SIZE_UNITS, 'max_size'),
+                    parse_quantity(data.get('min_age'), AGE_UNITS, 'min_age'),
+                    parse_quantity(data.get('max_age'), AGE_UNITS, 'max_age'),
+                    destination.strip('/'))
+    except (re.error, ValueError) as e:
+        raise ValueError(f"Rule {index}: {str(e)}")
+
+
+def _regex_literal(regex):
+    """Return the longest ASCII literal, lowercased, that every match of regex contains, or None"""
+    try:
+        parsed = sre_parse.parse(regex)
+    except (re.error, RecursionError):
+        return None
+    longest = run = ''
+    # Only the top-level sequence is required, branches and repeats end a literal run
+    for op, value in parsed:
+        if op is sre_parse.LITERAL and value < 128:
+            run += chr(value).lower()
+            longest = max(longest, run, key=len)
+        elif op is not sre_parse.AT:
+            run = ''
+    return longest or None
+
+
+def _glob_literal(glob):
+    """Return the longest ASCII literal, lowercased, that every name matched by glob contains, or None"""
+    if '[' in glob:
+        return None  # Character sets may hold the literal characters too
+    longest = max(_WILDCARDS.split(glob), key=len)
+    return longest.lower() if longest and longest.isascii() else None
+
+
+class RuleSet:
+    """
+    Ordered rules compiled into a single dispatcher, the first matching rule wins.
+
+    Name patterns are matched case-insensitively. A rule without glob or regex
+    matches every name, a rule with both needs both to match.
+
+    Usage example:
+        rules = RuleSet.load('/etc/onlyfiles/rules.json')
+        rule = rules.match('IMG_0001.JPG', entry.stat)
+        folder = rules.destination(rule, entry.stat(), 'Images', '.jpg')
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # Rules whose name test is a hash lookup: by lowercased suffix and by lowercased name
+        self.__by_suffix = {}
+        self.__by_name = {}
+        self.__max_suffix_dots = 0
+        # Rules without a name test, matching every name
+        self.__always = []
+        # Compiled glob pattern and regex of the other rules, by rule index
+        self.__patterns = {}
+        # Pattern rules with a required literal, as (index, literal) by the first KEY_LENGTH characters of it
+        self.__by_literal = {}
+        self.__key_lengths = set()
+        # Pattern rules without a required literal, in order
+        self.__complex = []
+        # Rules among them whose test can't be embedded in the combined expression (inline flags, groups)
+        self.__standalone = []
+
+        alternatives = []
+        for index, rule in enumerate(self.rules):
+            pattern = self.__name_pattern(rule)
+            if pattern is not None:
+                compiled = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+                regex = re.compile(rule.regex, re.IGNORECASE | re.DOTALL) if rule.regex is not None else None
+                self.__patterns[index] = (compiled, regex)
+                literals = self.__required_literals(rule)
+                if literals:
+                    for literal in set(literals):
+                        key = literal[:KEY_LENGTH]
+                        self.__by_literal.setdefault(key, []).append((index, literal))
+                        self.__key_lengths.add(len(key))
+                else:
+                    combined = self.__combined_pattern(pattern, rule.regex)
+                    if combined is None:
+                        self.__standalone.append(index)
+                    else:
+                        self.__complex.append(index)
+                        alternatives.append(f'(?P<r{index}>{combined})')
+                continue
+            if not rule.globs:
+                self.__always.append(index)
+            for glob in rule.globs:
+                suffix = _SUFFIX_GLOB.match(glob)
+                if suffix:
+                    self.__by_suffix.setdefault(suffix.group(1).lower(), []).append(index)
+                    self.__max_suffix_dots = max(self.__max_suffix_dots, suffix.group(1).count('.'))
+                else:
+                    self.__by_name.setdefault(glob.lower(), []).append(index)
+
+        # First folder of every destination, compiled for the category names it is checked with
+        self.__destination_key = None
+        self.__destination_pattern = None
+
+        # One expression for the glob patterns without literal, its match tells the first of these rules matching a name
+        self.__combined = re.compile('|'.join(alternatives), re.IGNORECASE | re.DOTALL) if alternatives else None
+
+    @staticmethod
+    def __name_pattern(rule):
+        """Private method to return the regular expression of a rule's globs, None if its name test is a hash lookup"""
+        simple = all(_SUFFIX_GLOB.match(glob) or not _GLOB_CHARS.search(glob) for glob in rule.globs)
+        if rule.regex is None and simple:
+            return None
+        if not rule.globs:
+            return '.*'
+        return '(?:' + '|'.join(fnmatch.translate(glob) for glob in rule.globs) + ')'
+
+    @staticmethod
+    def __combined_pattern(pattern, regex):
+        """Private method to return a rule's name test as one expression to embed in the combined one, None if it can't be"""
+        if regex is not None:
+            # The regex may match anywhere in the name, like re.search
+            pattern = f'(?={pattern})(?=.*?(?:{regex}))'
+        try:
+            # Inline flags are only allowed at the start and groups would shift the rule groups
+            compiled = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+        except re.error:
+            return None
+        return pattern if not compiled.groups and '(?P=' not in pattern else None
+
+    def __matches_name(self, index, name):
+        """Private method to test the globs and regex of a pattern rule against a name"""
+        glob, regex = self.__patterns[index]
+        # The regex may match anywhere in the name, like re.search
+        return glob.match(name) is not None and (regex is None or regex.search(name) is not None)
+
+    @staticmethod
+    def __required_literals(rule):
+        """Private method to return literals one of which is in every name matched by a rule, None if unknown"""
+        literal = _regex_literal(rule.regex) if rule.regex is not None else None
+        if literal:
+            return [literal]
+        literals = [_glob_literal(glob) for glob in rule.globs]
+        return literals if literals and all(literals) else None
+
+    @classmethod
+    def load(cls, path):
+        """Read the rules of a JSON file holding {"rules": [...]}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rules = data.get('rules') if isinstance(data, dict) else None
+        if not isinstance(rules, list):
+            raise ValueError(f"No rules list in {path}")
+        return cls(parse_rule(rule, index) for index, rule in enumerate(rules, 1))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def key(self):
+        """Return a value identifying the rules, equal for equal rule lists"""
+        return tuple(self.rules)
+
+    @property
+    def has_age_checks(self):
+        """Return True if a rule checks the age of files"""
+        return any(rule.has_age_checks for rule in self.rules)
+
+    def __lookup(self, lowered):
+        """Private method to return the indexes of the hash-looked-up rules matching a lowercased name"""
+        found = list(self.__by_name.get(lowered, ()))
+        end = len(lowered)
+        for _ in range(self.__max_suffix_dots):
+            position = lowered.rfind('.', 0, end)
+            if position == -1:
+                break
+            found.extend(self.__by_suffix.get(lowered[position:], ()))
+            end = position
+        return found
+
+    def match(self, name, get_stat):
+        """
+        Return the first rule matching a file, or None.
+
+        Parameters:
+        name (str): File name
+        get_stat (callable): Returns the os.stat result of the file, only called for rules checking size or age
+        """
+        lowered = name.lower()
+        # Rules known to match the name, and rules whose pattern still has to be tested
+        matched = set(self.__lookup(lowered))
+        matched.update(self.__always)
+        tested = set(self.__standalone)
+
+        for length in self.__key_lengths:
+            for start in range(len(lowered) - length + 1):
+                for index, literal in self.__by_literal.get(lowered[start:start + length], ()):
+                    if literal in lowered:
+                        tested.add(index)
+        if self.__combined is not None:
+            found = self.__combined.match(name)
+            if found is not None:
+                first_complex = int(found.lastgroup[1:])
+                matched.add(first_complex)
+                # Later rules without literal are only tested if no earlier rule matched
+                tested.update(index for index in self.__complex if index > first_complex)
+
+        stat = None
+        now = None
+        for index in sorted(matched | tested):
+            if index in matched or self.__matches_name(index, name):
+                rule = self.rules[index]
+                if not rule.has_stat_checks:
+                    return rule
+                if stat is None:
+                    stat, now = get_stat(), time.time()
+                if rule.matches_stat(stat, now):
+                    return rule
+        return None
+
+    @staticmethod
+    def destination(rule, stat, category, extension):
+        """Return the folder of a file matched by rule, relative to the folder it is in"""
+        modified = datetime.fromtimestamp(stat.st_mtime)
+        return rule.destination.format(category=category, year=f'{modified.year:04d}', month=f'{modified.month:02d}',
+                                       day=f'{modified.day:02d}', ext=extension.lstrip('.').lower() or 'none')
+
+    def is_destination_dir(self, name, categories):
+        """Return True if a folder name may have been created by a rule's destination, categories are the category folder names"""
+        key = frozenset(categories)
+        if self.__destination_key != key:
+            self.__destination_pattern = self.__compile_destinations(key)
+            self.__destination_key = key
+        return self.__destination_pattern.match(name) is not None
+
+    def __compile_destinations(self, categories):
+        """Private method to compile the first folder of every destination into one anchored expression"""
+        fields = dict(FIELD_PATTERNS, category='|'.join(re.escape(category) for category in sorted(categories)) or '[^/]+')
+        alternatives = []
+        for rule in self.rules:
+            first = rule.destination.split('/', 1)[0]
+            pattern = ''.join(re.escape(literal) + (f'(?:{fields[field]})' if field is not None else '')
+                              for literal, field, _, _ in string.Formatter().parse(first))
+            alternatives.append(f'(?:{pattern})')
+        return re.compile('(?:' + '|'.join(alternatives) + r')\Z') if alternatives else re.compile(r'(?!)')
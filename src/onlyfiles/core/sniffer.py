@@ -0,0 +1,227 @@
+"""
+Content type detection from file signatures.
+The first bytes of a file are matched against the magic numbers of common
+image, audio, video and document formats, so files without an extension or
+with a wrong one can still be classified. Results are cached by inode and
+modification time, re-runs don't open unchanged files again.
+"""
+
+import codecs
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from onlyfiles.core.hash_cache import HASH_CACHE_FILE
+from onlyfiles.core.mover import DEFAULT_WORKERS
+
+# Number of bytes read from the start of each file
+HEADER_SIZE = 4096
+
+# Number of files looked up and read together
+BATCH_SIZE = 256
+
+# DIB header sizes of the BMP versions (core, info, v2, OS/2 2, v3, v4, v5)
+_BMP_DIB_SIZES = frozenset({12, 40, 52, 56, 64, 108, 124})
+
+# Whitespace allowed in a text header, removed before checking that the rest is printable
+_TEXT_WHITESPACE = dict.fromkeys(map(ord, '\t\n\r\f\v'))
+
+
+def _valid_bmp(header):
+    """Check the reserved fields and the DIB header size of a BMP file header"""
+    return (len(header) >= 18 and header[6:10] == b'\x00\x00\x00\x00'
+            and int.from_bytes(header[14:18], 'little') in _BMP_DIB_SIZES)
+
+
+def _valid_id3(header):
+    """Check the version and the synchsafe size of an ID3v2 tag header"""
+    return len(header) >= 10 and 2 <= header[3] <= 4 and all(byte < 0x80 for byte in header[6:10])
+
+
+def _valid_mpeg_audio(header):
+    """Check the bitrate and sample rate fields of an MPEG audio frame header"""
+    return len(header) >= 4 and 0 < header[2] >> 4 < 15 and (header[2] >> 2) & 3 != 3
+
+
+def _valid_adts(header):
+    """Check the sample rate and frame length fields of an AAC ADTS frame header"""
+    if len(header) < 7:
+        return False
+    frame_length = (header[3] & 3) << 11 | header[4] << 3 | header[5] >> 5
+    return (header[2] >> 2) & 15 <= 12 and frame_length >= 7
+
+
+# (offset, magic bytes, extension, check of the rest of the header or None), checked in order
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', '.jpg', None),
+    (0, b'\x89PNG\r\n\x1a\n', '.png', None),
+    (0, b'GIF87a', '.gif', None),
+    (0, b'GIF89a', '.gif', None),
+    (0, b'II*\x00', '.tiff', None),
+    (0, b'MM\x00*', '.tiff', None),
+    (0, b'BM', '.bmp', _valid_bmp),
+    (0, b'%PDF-', '.pdf', None),
+    (0, b'fLaC', '.flac', None),
+    (0, b'OggS', '.ogg', None),
+    (0, b'ID3', '.mp3', _valid_id3),
+    (0, b'\xff\xfb', '.mp3', _valid_mpeg_audio),
+    (0, b'\xff\xf3', '.mp3', _valid_mpeg_audio),
+    (0, b'\xff\xf1', '.aac', _valid_adts),
+    (0, b'\xff\xf9', '.aac', _valid_adts),
+    (0, b'FLV\x01', '.flv', None),
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', '.wmv', None),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', '.doc', None),
+)
+
+# RIFF containers, told apart by the form type at offset 8
+RIFF_TYPES = {b'WEBP': '.webp', b'WAVE': '.wav', b'AVI ': '.avi'}
+
+# ISO base media brands at offset 8 that aren't plain MP4 video
+FTYP_BRANDS = {b'M4A ': '.m4a', b'M4B ': '.m4a', b'qt  ': '.mov'}
+
+# Detected extensions that several formats share, a known extension of the file name is trusted over them
+AMBIGUOUS_EXTENSIONS = frozenset({'.mp4', '.mkv', '.doc', '.docx'})
+
+
+def sniff(header):
+    """Return the extension of the format whose signature starts header, or None"""
+    if _is_text(header):
+        # Short signatures such as "BM" or "ID3" also start ordinary text files
+        return _sniff_text(header)
+
+    for offset, magic, extension, check in SIGNATURES:
+        if header.startswith(magic, offset) and (check is None or check(header)):
+            return extension
+
+    if header.startswith(b'RIFF'):
+        return RIFF_TYPES.get(header[8:12])
+    if header[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(header[8:12], '.mp4')
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        # Matroska declares its document type early in the EBML header
+        return '.webm' if b'webm' in header[:64] else '.mkv'
+    if header.startswith(b'PK\x03\x04'):
+        # The first member of an OpenDocument file is its uncompressed mimetype
+        if b'opendocument.text' in header:
+            return '.odt'
+        for folder, extension in ((b'word/', '.docx'), (b'xl/', '.xlsx'), (b'ppt/', '.pptx')):
+            if folder in header:
+                return extension
+    return None
+
+
+def _is_text(header):
+    """Check if a header is printable UTF-8 text, a character cut at its end is ignored"""
+    try:
+        text = codecs.getincrementaldecoder('utf-8')().decode(header)
+    except UnicodeDecodeError:
+        return False
+    return bool(text) and text.lstrip('\ufeff').translate(_TEXT_WHITESPACE).isprintable()
+
+
+def _sniff_text(header):
+    """Return the extension of the text format header starts with, or None"""
+    if header.startswith(b'%PDF-'):
+        return '.pdf'  # PDF files may be written in plain ASCII
+    text = header.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if text.startswith(b'<svg') or (text.startswith(b'<?xml') and b'<svg' in text):
+        return '.svg'
+    return None
+
+
+def read_header(path, size=HEADER_SIZE):
+    """Return the first size bytes of a file"""
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+def typed_name(type_index, name, extension):
+    """
+    Return the name a file would have with the extension detected from its content.
+
+    The name is kept when the detection failed, when it agrees with the category of a
+    known extension of the name, or when it is ambiguous and the name has a known extension.
+    """
+    if extension is None:
+        return name
+    if type_index.match(name) is not None:
+        if extension in AMBIGUOUS_EXTENSIONS or type_index.classify(name) == type_index.classify('file' + extension):
+            return name
+    return name + extension
+
+
+class ContentSniffer:
+    """
+    Batched, parallel content type detection with a persistent result cache.
+
+    Results are stored in the hash cache database, keyed by (st_dev, st_ino,
+    st_mtime_ns), files without a known signature are cached too.
+
+    Usage example:
+        sniffer = ContentSniffer(max_workers=8)
+        for entry, extension in sniffer.sniff_entries(os.scandir('/data/inbox')):
+            ...
+        sniffer.close()
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, cache_path=HASH_CACHE_FILE):
+        self.__max_workers = max(1, max_workers or 1)
+        # Without a cache file the results only last for this run
+        self.__db = sqlite3.connect(cache_path or ':memory:')
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS sniffed (
+                                 dev INTEGER, ino INTEGER, mtime_ns INTEGER, extension TEXT NOT NULL,
+                                 PRIMARY KEY (dev, ino, mtime_ns)
+                             ) WITHOUT ROWID''')
+
+    def __lookup(self, key):
+        """Private method to return the cached extension of a file, '' for no known signature, or None"""
+        row = self.__db.execute('SELECT extension FROM sniffed WHERE dev=? AND ino=? AND mtime_ns=?', key).fetchone()
+        return row[0] if row else None
+
+    def __read(self, path):
+        """Private method to detect the format of a file, '' if it has no known signature, None if it can't be read"""
+        try:
+            return sniff(read_header(path)) or ''
+        except OSError:
+            return None  # Not cached, the file may be readable next time
+
+    def sniff_entries(self, entries):
+        """
+        Detect the format of files from their content.
+
+        Only BATCH_SIZE entries are pulled from entries at a time, so a streamed
+        listing is never held whole in memory.
+
+        Parameters:
+        entries (iterable): os.DirEntry objects of the files
+
+        Yields:
+        tuple: Each entry and its detected extension (e.g. '.jpg') or None, in the order of entries
+        """
+        entries = iter(entries)
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as pool:
+            while True:
+                batch = list(islice(entries, BATCH_SIZE))
+                if not batch:
+                    return
+                keys = []
+                for entry in batch:
+                    stat = entry.stat()
+                    keys.append((stat.st_dev, stat.st_ino, stat.st_mtime_ns))
+                found = [self.__lookup(key) for key in keys]
+
+                # Only the files without a cached result are opened, concurrently
+                missing = [i for i, extension in enumerate(found) if extension is None]
+                for i, extension in zip(missing, pool.map(self.__read, (batch[i].path for i in missing))):
+                    found[i] = extension
+                with self.__db:
+                    self.__db.executemany('INSERT OR REPLACE INTO sniffed VALUES (?, ?, ?, ?)',
+                                          [keys[i] + (found[i],) for i in missing if found[i] is not None])
+
+                for entry, extension in zip(batch, found):
+                    yield entry, extension or None
+
+    def close(self):
+        """Close the cache database"""
+        self.__db.close()
@@ -0,0 +1,132 @@
+"""
+Per-phase timing of the organize runs.
+Functions are wrapped once per run with the phase they belong to, so an
+instrumented run records the time and number of calls of each phase while a
+run without statistics gets the original functions back and pays nothing.
+"""
+
+import threading
+import time
+from collections import Counter
+
+# Phases in the order they are shown, phases not listed here come after them
+PHASES = ('listing', 'exclusions', 'stat', 'sniff', 'classify', 'hash', 'mkdir', 'capacity', 'move', 'journal',
+          'logging', 'index')
+
+
+class RunStats:
+    """
+    Time and number of calls of each phase of a run, and its counters.
+
+    The time of a phase excludes the phases it calls, e.g. the exclusion checks
+    made while listing a directory count as exclusions, not as listing. Phases
+    running on several threads add up the time of every thread.
+
+    Usage example:
+        stats = RunStats()
+        is_excluded = stats.wrap('exclusions', exclusions.is_excluded)
+        for entry in stats.iterate('listing', os.scandir(directory)):
+            ...
+        stats.count('bytes_moved', 1024)
+        report = stats.to_dict()
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # Time spent in nested phases by the phase running on each thread
+        self.__local = threading.local()
+        # Phase name -> [calls, seconds]
+        self.__phases = {}
+        self.counters = Counter()
+        self.__start = time.perf_counter()
+
+    def __enter(self):
+        """Private method to start timing a call, return the token ending it"""
+        local = self.__local
+        outer = getattr(local, 'nested', 0.0)
+        local.nested = 0.0
+        return outer, time.perf_counter()
+
+    def __exit(self, phase, token, calls=1):
+        """Private method to end timing a call and add its own time to its phase"""
+        outer, start = token
+        elapsed = time.perf_counter() - start
+        local = self.__local
+        own = elapsed - local.nested
+        local.nested = outer + elapsed
+        with self.__lock:
+            record = self.__phases.setdefault(phase, [0, 0.0])
+            record[0] += calls
+            record[1] += own
+
+    def wrap(self, phase, func):
+        """Return func timed as part of phase"""
+        def timed(*args, **kwargs):
+            token = self.__enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.__exit(phase, token)
+        return timed
+
+    def iterate(self, phase, iterable):
+        """Yield the items of iterable, timing the production of each one as part of phase"""
+        iterator = iter(iterable)
+        while True:
+            token = self.__enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.__exit(phase, token, calls=0)
+                return
+            except BaseException:
+                self.__exit(phase, token)
+                raise
+            self.__exit(phase, token)
+            yield item
+
+    def count(self, counter, value=1):
+        """Add value to a counter"""
+        with self.__lock:
+            self.counters[counter] += value
+
+    def elapsed(self):
+        """Return the seconds since the statistics were created"""
+        return time.perf_counter() - self.__start
+
+    def phases(self):
+        """Return (phase, calls, seconds) tuples in PHASES order"""
+        with self.__lock:
+            phases = dict(self.__phases)
+        order = {phase: index for index, phase in enumerate(PHASES)}
+        return [(phase, calls, seconds) for phase, (calls, seconds)
+                in sorted(phases.items(), key=lambda item: (order.get(item[0], len(order)), item[0]))]
+
+    def to_dict(self):
+        """Return the statistics as a JSON-serializable dictionary"""
+        return {
+            'wall_seconds': self.elapsed(),
+            'phases': {phase: {'calls': calls, 'seconds': seconds} for phase, calls, seconds in self.phases()},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+
+class NullStats:
+    """Disabled statistics, functions and iterables are handed back unchanged"""
+
+    enabled = False
+
+    def wrap(self, phase, func):
+        return func
+
+    def iterate(self, phase, iterable):
+        return iterable
+
+    def count(self, counter, value=1):
+        pass
+
+
+# Shared instance used when a run has no statistics
+NULL_STATS = NullStats()
@@ -0,0 +1,82 @@
+"""
+Compiled lookup index for the file type definitions.
+Maps lowercased file suffixes to their category so that classifying a file
+is a hash lookup instead of a scan over every category and extension.
+"""
+
+import os
+
+# Compiled indexes, keyed by the content of the types dictionary they were built from
+_index_cache = {}
+
+
+class TypeIndex:
+    """Hash index from lowercased suffix to category with longest-suffix matching"""
+
+    def __init__(self, types_dict):
+        self.__index = {}
+        # Number of dot-separated parts of the longest known suffix (e.g. 2 for ".tar.gz")
+        self.__max_parts = 1
+
+        for category, extensions in types_dict.items():
+            for ext in extensions:
+                ext = ext.lower()
+                if not ext.startswith('.'):
+                    ext = '.' + ext
+                # The first category declaring an extension wins, as in the original lookups
+                self.__index.setdefault(ext, category)
+                self.__max_parts = max(self.__max_parts, ext.count('.'))
+
+    @property
+    def extensions(self):
+        """Return the set of all known suffixes"""
+        return frozenset(self.__index)
+
+    def __candidates(self, file_name):
+        """Return the lowercased name and its suffix start positions, longest suffix first"""
+        name = file_name.lower()
+        # Leading dots belong to the name (".bashrc" has no extension), as in os.path.splitext
+        first = len(name) - len(name.lstrip('.')) + 1
+
+        positions = []
+        end = len(name)
+        while len(positions) < self.__max_parts:
+            pos = name.rfind('.', first, end)
+            if pos == -1:
+                break
+            positions.append(pos)
+            end = pos
+        positions.reverse()
+        return name, positions
+
+    def match(self, file_name):
+        """Return the longest known suffix of a file name, or None"""
+        name, positions = self.__candidates(file_name)
+        for pos in positions:
+            if name[pos:] in self.__index:
+                return name[pos:]
+        return None
+
+    def suffix(self, file_name):
+        """Return the longest known suffix of a file name, falling back to its last extension"""
+        known = self.match(file_name)
+        if known is not None:
+            return known
+        return os.path.splitext(file_name)[1].lower()
+
+    def classify(self, file_name, default=None):
+        """Return the category of a file name, or default if no suffix is known"""
+        known = self.match(file_name)
+        if known is None:
+            return default
+        return self.__index[known]
+
+
+def get_type_index(types_dict):
+    """Return the compiled index for a types dictionary, building it only once"""
+    key = tuple((category, tuple(extensions)) for category, extensions in types_dict.items())
+    index = _index_cache.get(key)
+    if index is None:
+        index = TypeIndex(types_dict)
+        _index_cache[key] = index
+    return index
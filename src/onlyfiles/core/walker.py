@@ -0,0 +1,50 @@
+"""
+Streaming directory tree walker.
+Yields file entries lazily with os.scandir, keeping only one open directory
+iterator per level of depth instead of materializing whole listings.
+"""
+
+import os
+
+
+def walk_files(root, max_depth=None, skip_dir=None, is_excluded=None, onerror=None):
+    """
+    Lazily yield os.DirEntry objects for the files under root.
+
+    Parameters:
+    root (str): Directory to walk
+    max_depth (int): Maximum depth to descend into (0 = only root, None = unlimited)
+    skip_dir (callable): Called with a directory entry, return True to not descend into it
+    is_excluded (callable): Called with an entry path, return True to ignore the entry
+    onerror (callable): Called with the OSError raised when a subdirectory can't be read
+    """
+    # Depth-first stack of open scandir iterators, bounded by the tree depth
+    stack = [(os.scandir(root), 0)]
+    try:
+        while stack:
+            iterator, depth = stack[-1]
+            entry = next(iterator, None)
+            if entry is None:
+                iterator.close()
+                stack.pop()
+                continue
+
+            if is_excluded is not None and is_excluded(entry.path):
+                continue
+
+            try:
+                # Don't follow directory symlinks to avoid cycles
+                if entry.is_dir(follow_symlinks=False):
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    if skip_dir is not None and skip_dir(entry):
+                        continue
+                    stack.append((os.scandir(entry.path), depth + 1))
+                elif entry.is_file():
+                    yield entry
+            except OSError as e:
+                if onerror is not None:
+                    onerror(e)
+    finally:
+        for iterator, _ in stack:
+            iterator.close()
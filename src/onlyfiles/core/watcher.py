@@ -0,0 +1,244 @@
+"""
+Change watchers for drop folders.
+On Linux the folder is watched with inotify, so an idle watch costs nothing;
+elsewhere scandir snapshots of the folder are compared at a fixed interval.
+Files are handed over only once they are fully written and left alone for a
+debounce delay, so bursts of files are organized together. Snapshots can't
+see whether a file is still open, the polling watcher only takes a file as
+written once it stayed the same for a settle delay spanning several scans.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# Default seconds a file must stay unchanged before it is organized
+DEFAULT_DEBOUNCE = 2.0
+
+# Default seconds between two snapshots of the polling watcher
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Default seconds a file must keep its size and modification time before the polling watcher takes it as written
+DEFAULT_SETTLE = 15.0
+
+# Minimum number of snapshots a file must stay the same in before it settles
+SETTLE_POLLS = 2
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Header of an inotify event: watch descriptor, mask, cookie and name length
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _snapshot(directory):
+    """Return the (st_ino, st_size, st_mtime_ns) of the files of a directory, by name"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue  # Removed while listing
+    return files
+
+
+class PollingWatcher:
+    """
+    Portable watcher comparing scandir snapshots of a directory.
+
+    A snapshot can't tell that a writer still has a file open, so a changed file
+    is reported as open until its size and modification time stayed the same for
+    settle seconds and at least SETTLE_POLLS snapshots. A writer pausing for
+    longer than that, e.g. a stalled download, can still be taken as done.
+    """
+
+    def __init__(self, directory, interval=DEFAULT_POLL_INTERVAL, settle=DEFAULT_SETTLE):
+        self.directory = directory
+        self.__interval = interval
+        self.__settle = settle
+        self.__files = _snapshot(directory)
+        # Name of each changed file -> [time of its last change, snapshots it stayed the same in]
+        self.__unsettled = {}
+        self.__next_poll = time.monotonic() + interval
+
+    def existing(self):
+        """Return the names of the files in the directory when the watch started"""
+        return list(self.__files)
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds (None = until something changes) for changes.
+
+        Returns:
+        dict: Name of each new or modified file mapped to False, or to True once it settled
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self.__next_poll:
+                self.__next_poll = now + self.__interval
+                changed = self.__poll(now)
+                if changed:
+                    return changed
+            if deadline is not None and now >= deadline:
+                return {}
+            wake = self.__next_poll if deadline is None else min(self.__next_poll, deadline)
+            time.sleep(max(0.0, wake - now))
+
+    def __poll(self, now):
+        """Private method to compare a new snapshot with the previous one, return the changed and settled files"""
+        files = _snapshot(self.directory)
+        changed = {}
+        for name, state in files.items():
+            if self.__files.get(name) != state:
+                self.__unsettled[name] = [now, 0]
+                changed[name] = False
+            elif name in self.__unsettled:
+                unsettled = self.__unsettled[name]
+                unsettled[1] += 1
+                if unsettled[1] >= SETTLE_POLLS and now - unsettled[0] >= self.__settle:
+                    del self.__unsettled[name]
+                    changed[name] = True
+        for name in self.__unsettled.keys() - files.keys():
+            del self.__unsettled[name]  # Moved away or deleted
+        self.__files = files
+        return changed
+
+    def close(self):
+        """Release the watcher"""
+
+
+class InotifyWatcher:
+    """Linux watcher reading the inotify events of a directory"""
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    def __init__(self, directory):
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self.__fd, os.fsencode(directory), self.MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.__fd)
+            raise OSError(error, os.strerror(error), directory)
+
+    def existing(self):
+        """Return the names of the files in the directory when the watch started"""
+        return list(_snapshot(self.directory))
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds (None = until something changes) for changes.
+
+        Returns:
+        dict: Name of each new or modified file mapped to True once it was closed after writing
+        """
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return {}
+
+        changed = {}
+        data = os.read(self.__fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += _EVENT_HEADER.size + length
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                raise FileNotFoundError(f"Watched directory was removed or moved: {self.directory}")
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, every file is checked again
+                changed.update((file, True) for file in _snapshot(self.directory))
+            elif name and not mask & IN_ISDIR:
+                # Moved in files are complete, written files are once closed
+                changed[name] = bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+        return changed
+
+    def close(self):
+        """Release the inotify descriptor"""
+        os.close(self.__fd)
+
+
+def open_watcher(directory, poll_interval=DEFAULT_POLL_INTERVAL, polling=False, settle=DEFAULT_SETTLE):
+    """Return an inotify watcher on Linux, a polling watcher elsewhere or when polling is set"""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass  # No inotify support (e.g. watch limit reached), poll instead
+    return PollingWatcher(directory, poll_interval, settle)
+
+
+class PendingFiles:
+    """
+    Files waiting to be organized.
+
+    A file is ready once it is closed and its size and modification time
+    stayed the same for debounce seconds.
+    """
+
+    def __init__(self, debounce=DEFAULT_DEBOUNCE):
+        self.__debounce = debounce
+        # Path -> [due time, (size, mtime_ns) when last seen, closed]
+        self.__files = {}
+
+    def __len__(self):
+        return len(self.__files)
+
+    def touch(self, path, closed=True):
+        """Record a change of a file, restarting its debounce delay"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.__files.pop(path, None)  # Moved away or deleted
+            return
+        self.__files[path] = [time.monotonic() + self.__debounce, (stat.st_size, stat.st_mtime_ns), closed]
+
+    def timeout(self):
+        """Return the seconds until the next closed file is due, None if there is none"""
+        # Open files wait for the event of their closing
+        due = [file[0] for file in self.__files.values() if file[2]]
+        if not due:
+            return None
+        return max(0.0, min(due) - time.monotonic())
+
+    def ready(self):
+        """Remove and return the paths of the files ready to be organized"""
+        now = time.monotonic()
+        ready = []
+        for path, file in list(self.__files.items()):
+            if file[0] > now or not file[2]:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.__files[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == file[1]:
+                ready.append(path)
+                del self.__files[path]
+            else:
+                # Still being written
+                file[0] = now + self.__debounce
+                file[1] = (stat.st_size, stat.st_mtime_ns)
+        return ready
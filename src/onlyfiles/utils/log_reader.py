@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Readers for the append-only log files.
+Files are read backwards from their end in fixed-size blocks, so looking at
+the most recent records costs the same however large the file has grown, and
+a sidecar offset index lets time range reads start close to their first record.
+Rotated, gzip compressed segments of a log are read after its active file.
+"""
+
+import bisect
+import gzip
+import itertools
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# Number of bytes read from the end of the file at a time
+BLOCK_SIZE = 64 * 1024
+
+# Header of a record written by Logger: 'YYYY-MM-DD HH:MM:SS - name - level - message'
+RECORD_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (.*?) - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - (.*)$',
+                            re.DOTALL)
+
+# Default number of records shown when viewing the logs
+DEFAULT_TAIL = 1000
+
+# Default number of records of a page of logs
+DEFAULT_PAGE_SIZE = 100
+
+# Format of the record timestamps
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Relative times accepted by parse_time, e.g. '30m' or '2d'
+RELATIVE_TIME_PATTERN = re.compile(r'^(\d+)([smhdw])$')
+RELATIVE_TIME_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+# Bytes of log between two entries of the offset index
+INDEX_INTERVAL = 1024 * 1024
+
+# Suffix of the compressed segments of a rotated log
+ARCHIVE_SUFFIX = '.gz'
+
+
+def read_lines_reversed(path, block_size=BLOCK_SIZE):
+    """
+    Lazily yield the lines of a UTF-8 text file, newest (last) first.
+
+    Parameters:
+    path (str): File to read
+    block_size (int): Number of bytes read at a time
+
+    Yields:
+    str: Each line without its line ending
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        # Incomplete first line of the blocks read so far
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.rstrip(b'\r').decode('utf-8', errors='replace')
+        if remainder:
+            yield remainder.rstrip(b'\r').decode('utf-8', errors='replace')
+
+
+class LogRecord(namedtuple('LogRecord', ['timestamp', 'name', 'level', 'message', 'text'])):
+    """Log record, timestamp is the 'YYYY-MM-DD HH:MM:SS' string and text the full record"""
+
+    __slots__ = ()
+
+
+def parse_record(text):
+    """Return the LogRecord of a record text, or None if it doesn't start with a record header"""
+    match = RECORD_PATTERN.match(text)
+    if match is None:
+        return None
+    return LogRecord(match.group(1), match.group(2), match.group(3), match.group(4), text)
+
+
+def log_segments(path):
+    """Return the active log file and its compressed archived segments, newest first"""
+    directory, name = os.path.split(path)
+    archives = []
+    try:
+        with os.scandir(directory or '.') as entries:
+            for entry in entries:
+                if entry.name.startswith(name + '.') and entry.name.endswith(ARCHIVE_SUFFIX):
+                    archives.append((entry.stat().st_mtime_ns, entry.path))
+    except FileNotFoundError:
+        pass
+    # Archives are never written again, their modification time is their rotation time
+    return [path] + [archive for _, archive in sorted(archives, reverse=True)]
+
+
+def read_log_lines_reversed(path, block_size=BLOCK_SIZE):
+    """Lazily yield the lines of a log and of its archived segments, newest first"""
+    for segment in log_segments(path):
+        if segment.endswith(ARCHIVE_SUFFIX):
+            # Compressed streams can't be read backwards, segments are bounded by the rotation size
+            with gzip.open(segment, 'rb') as f:
+                lines = f.read().split(b'\n')
+            for line in reversed(lines):
+                if line:
+                    yield line.rstrip(b'\r').decode('utf-8', errors='replace')
+        else:
+            try:
+                yield from read_lines_reversed(segment, block_size)
+            except FileNotFoundError:
+                continue  # Rotated away and not recreated yet
+
+
+def read_records_reversed(path, block_size=BLOCK_SIZE):
+    """
+    Lazily yield the records of a log file and of its archived segments, newest first.
+
+    Lines without a record header (e.g. tracebacks) are joined to the record they follow.
+    """
+    continuation = []
+    for line in read_log_lines_reversed(path, block_size):
+        continuation.append(line)
+        record = parse_record(line)
+        if record is not None:
+            yield parse_record('\n'.join(reversed(continuation)))
+            continuation = []
+
+
+def tail(path, count=DEFAULT_TAIL):
+    """Return the last count records of a log file, oldest first"""
+    return list(reversed(list(itertools.islice(read_records_reversed(path), count))))
+
+
+def _records_from_lines(raw_lines):
+    """Yield the records of an iterable of raw log lines, oldest first"""
+    lines = []
+    for raw in raw_lines:
+        line = raw.rstrip(b'\r\n').decode('utf-8', errors='replace')
+        if lines and RECORD_PATTERN.match(line):
+            yield parse_record('\n'.join(lines))
+            lines = []
+        # Lines before the first header of the range have no record to belong to
+        if lines or RECORD_PATTERN.match(line):
+            lines.append(line)
+    if lines:
+        yield parse_record('\n'.join(lines))
+
+
+def read_records(path, offset=0):
+    """Lazily yield the records of a log file from a byte offset, oldest first"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        yield from _records_from_lines(f)
+
+
+class LogIndex:
+    """
+    Sidecar index of a log file mapping timestamps to byte offsets.
+
+    The index file next to the log holds one 'timestamp<TAB>offset' line about
+    every INDEX_INTERVAL bytes of log, and is extended incrementally as the log grows.
+
+    Usage example:
+        index = LogIndex(Logger.LOG_FILE)
+        for record in read_records(Logger.LOG_FILE, index.offset_before('2024-05-01 10:00:00')):
+            print(record.text)
+    """
+
+    def __init__(self, log_path, interval=INDEX_INTERVAL):
+        self.log_path = log_path
+        self.path = log_path + '.idx'
+        self.__interval = interval
+        self.__entries = None
+
+    def __load(self):
+        """Private method to read the index file"""
+        entries = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    timestamp, _, offset = line.rstrip('\n').partition('\t')
+                    if offset.isdigit():
+                        entries.append((timestamp, int(offset)))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def __is_valid(self, entries, log_file):
+        """Private method to check that the last entry still points at its record (the log may have been cleared)"""
+        if not entries:
+            return True
+        timestamp, offset = entries[-1]
+        log_file.seek(offset)
+        return log_file.readline().decode('utf-8', errors='replace').startswith(timestamp)
+
+    def update(self):
+        """Index the part of the log written since the last update, return the index entries"""
+        try:
+            log_file = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            self.__entries = []
+            return self.__entries
+
+        with log_file:
+            entries = self.__load()
+            mode = 'a'
+            if not self.__is_valid(entries, log_file):
+                entries, mode = [], 'w'
+
+            offset = entries[-1][1] if entries else 0
+            next_offset = offset + self.__interval if entries else 0
+            log_file.seek(offset)
+            new_entries = []
+            for line in log_file:
+                if offset >= next_offset:
+                    match = RECORD_PATTERN.match(line.decode('utf-8', errors='replace'))
+                    if match is not None:
+                        new_entries.append((match.group(1), offset))
+                        next_offset = offset + self.__interval
+                offset += len(line)
+
+        if new_entries or mode == 'w':
+            with open(self.path, mode, encoding='utf-8') as f:
+                f.writelines(f'{timestamp}\t{position}\n' for timestamp, position in new_entries)
+        self.__entries = entries + new_entries
+        return self.__entries
+
+    def offset_before(self, timestamp):
+        """Return a byte offset of the log at or before the first record logged at timestamp"""
+        entries = self.update() if self.__entries is None else self.__entries
+        # Last indexed record strictly older than timestamp, records of the same second may precede it
+        position = bisect.bisect_left([entry[0] for entry in entries], timestamp) - 1
+        return entries[position][1] if position >= 0 else 0
+
+
+def parse_time(value, now=None):
+    """
+    Return the record timestamp string for a time given as 'YYYY-MM-DD HH:MM:SS', 'YYYY-MM-DD'
+    or as a time relative to now such as '30m', '1h' or '2d'.
+
+    Raises ValueError for any other format.
+    """
+    value = value.strip()
+    match = RELATIVE_TIME_PATTERN.match(value)
+    if match:
+        delta = timedelta(**{RELATIVE_TIME_UNITS[match.group(2)]: int(match.group(1))})
+        return ((now or datetime.now()) - delta).strftime(TIMESTAMP_FORMAT)
+    for date_format in (TIMESTAMP_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, date_format).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time: {value}")
+
+
+class LogFilter(namedtuple('LogFilter', ['since', 'until', 'min_level', 'name', 'contains'])):
+    """
+    Record filter, every field being optional.
+
+    since/until are record timestamp strings (inclusive), min_level a level name such
+    as 'WARNING', name a logger name and contains a substring of the record text.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, since=None, until=None, min_level=None, name=None, contains=None):
+        return super().__new__(cls, since, until, min_level, name, contains)
+
+    def matches(self, record):
+        """Return True if a record passes every filter"""
+        if self.since is not None and record.timestamp < self.since:
+            return False
+        if self.until is not None and record.timestamp > self.until:
+            return False
+        if self.min_level is not None and logging.getLevelName(record.level) < logging.getLevelName(self.min_level):
+            return False
+        if self.name is not None and record.name != self.name:
+            return False
+        if self.contains is not None and self.contains not in record.text:
+            return False
+        return True
+
+
+def read_all_records(path, since=None):
+    """
+    Lazily yield the records of a log and of its archived segments, oldest first.
+
+    With since, archived segments rotated before it are skipped and the active file is
+    read from the offset given by its index, so the read starts close to the first record.
+    """
+    for segment in reversed(log_segments(path)):
+        if segment.endswith(ARCHIVE_SUFFIX):
+            # A segment stops receiving records when it is rotated
+            if since is not None and datetime.fromtimestamp(os.stat(segment).st_mtime).strftime(TIMESTAMP_FORMAT) < since:
+                continue
+            with gzip.open(segment, 'rb') as f:
+                yield from _records_from_lines(f)
+        else:
+            offset = LogIndex(segment).offset_before(since) if since is not None else 0
+            try:
+                yield from read_records(segment, offset)
+            except FileNotFoundError:
+                continue
+
+
+def query_records(path, log_filter=None, tail_count=None, page=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return the matching records of a log and of its archived segments, oldest first.
+
+    Parameters:
+    path (str): Log file
+    log_filter (LogFilter): Filter of the records (default: every record)
+    tail_count (int): Return only the last tail_count matching records, read from the end of the log
+    page (int): Return the page-th (1-based) page of page_size matching records, read from the start
+    page_size (int): Number of records of a page
+
+    Records are streamed, only the returned records are kept in memory.
+    """
+    log_filter = log_filter or LogFilter()
+
+    if page is None:
+        records = []
+        for record in read_records_reversed(path):
+            # Records are read newest first, nothing older can match
+            if log_filter.since is not None and record.timestamp < log_filter.since:
+                break
+            if log_filter.matches(record):
+                records.append(record)
+                if tail_count is not None and len(records) >= tail_count:
+                    break
+        records.reverse()
+        return records
+
+    records = read_all_records(path, log_filter.since)
+    if log_filter.until is not None:
+        # Records are read oldest first, nothing newer can match
+        records = itertools.takewhile(lambda record: record.timestamp <= log_filter.until, records)
+    matching = (record for record in records if log_filter.matches(record))
+    start = (page - 1) * page_size
+    return list(itertools.islice(matching, start, start + page_size))
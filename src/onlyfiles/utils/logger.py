@@ -1,9 +1,38 @@
 # -*- coding: utf-8 -*-
+import atexit
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 import platform
 import sys
 from os.path import expanduser, join
+from onlyfiles.utils.log_reader import tail, log_segments, read_log_lines_reversed, query_records, ARCHIVE_SUFFIX, DEFAULT_PAGE_SIZE
+
+
+def _archive_name(name):
+    """Name of a rotated log segment, compressed with gzip"""
+    return name + ARCHIVE_SUFFIX
+
+
+def _archive_segment(source, destination):
+    """Compress a rotated log segment and remove the uncompressed file"""
+    with open(source, 'rb') as src, gzip.open(destination, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _stop_listeners():
+    """Write the queued records of every queued logger before the interpreter exits"""
+    while Logger._listeners:
+        _, listener = Logger._listeners.popitem()
+        listener.stop()
+
+
+atexit.register(_stop_listeners)
+
 
 class Logger:
     """
@@ -16,12 +45,30 @@ class Logger:
         logger.info("Information message")
     """
 
-    # Dictionary to track configured loggers
+    # Dictionary to track configured loggers, and whether they are queued
     _configured_loggers = {}
 
+    # Background listeners of the queued loggers
+    _listeners = {}
+
+    # File handler shared by every logger writing to a log file, so one handler rotates it
+    _file_handlers = {}
+
     # Default log file path
     LOG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'docs', 'app.log')
 
+    # Size of the log file before it is rotated into a compressed segment (0 disables size rotation)
+    LOG_MAX_BYTES = int(os.environ.get('ONLYFILES_LOG_MAX_BYTES', 10 * 1024 * 1024))
+
+    # Number of compressed segments kept, older ones are deleted
+    LOG_BACKUP_COUNT = int(os.environ.get('ONLYFILES_LOG_BACKUPS', 10))
+
+    # Time based rotation instead of size based, e.g. 'midnight' or 'H' (see TimedRotatingFileHandler)
+    LOG_ROTATE_WHEN = os.environ.get('ONLYFILES_LOG_ROTATE_WHEN')
+
+    # Write records from a background thread instead of the logging thread
+    LOG_QUEUED = os.environ.get('ONLYFILES_LOG_QUEUE', '').lower() in ('1', 'true', 'yes')
+
     # Define property methods first to ensure they're properly recognized
     @property
     def log_dir(self):
@@ -41,16 +88,18 @@ class Logger:
         """
         return Logger.LOG_FILE
 
-    def __init__(self, name=__name__, verbose=False):
+    def __init__(self, name=__name__, verbose=False, queued=None):
         """
         Get a configured logger instance.
 
         Parameters:
         name (str): Logger name (default: current module name)
         verbose (bool): Ignored - logs are always shown in console and saved to file
+        queued (bool): Hand records to a background thread that writes them (default: LOG_QUEUED)
         """
         # Initialize important attributes first
         self._name = name
+        self._queued = Logger.LOG_QUEUED if queued is None else queued
         self._configured = False
         self.logger = logging.getLogger(name)
 
@@ -75,9 +124,9 @@ class Logger:
 
             # Setup the logger
             logger_key = f"{name}"
-            if logger_key not in Logger._configured_loggers:
+            if Logger._configured_loggers.get(logger_key) != self._queued:
                 self._setup_logging()
-                Logger._configured_loggers[logger_key] = True
+                Logger._configured_loggers[logger_key] = self._queued
                 self._configured = True
 
         except Exception as e:
@@ -167,6 +216,7 @@ class Logger:
                 print(f"  Handler {i+1}: {handler_type}")
                 if isinstance(handler, logging.FileHandler):
                     print(f"    - File: {handler.baseFilename}")
+                    print(f"    - Archived segments: {len(log_segments(handler.baseFilename)) - 1}")
                     print(f"    - Encoding: {handler.encoding}")
                     print(f"    - Mode: {handler.mode}")
                     try:
@@ -175,6 +225,30 @@ class Logger:
                     except:
                         print("    - Cannot access file information")
 
+    def _create_file_handler(self):
+        """
+        Return the file handler of the log file, rotating the log by size or time into gzip
+        compressed segments and keeping the LOG_BACKUP_COUNT most recent ones.
+        Loggers writing to the same file share one handler.
+        """
+        handler = Logger._file_handlers.get(self._log_file)
+        if handler is not None:
+            return handler
+
+        if Logger.LOG_ROTATE_WHEN:
+            handler = logging.handlers.TimedRotatingFileHandler(
+                self._log_file, when=Logger.LOG_ROTATE_WHEN, backupCount=Logger.LOG_BACKUP_COUNT, encoding='utf-8')
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                self._log_file, maxBytes=Logger.LOG_MAX_BYTES, backupCount=Logger.LOG_BACKUP_COUNT, encoding='utf-8')
+        handler.namer = _archive_name
+        handler.rotator = _archive_segment
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                                               datefmt='%Y-%m-%d %H:%M:%S'))
+        Logger._file_handlers[self._log_file] = handler
+        return handler
+
     def _setup_logging(self):
         """
         Configure logging to both file and console.
@@ -191,22 +265,41 @@ class Logger:
             datefmt='%Y-%m-%d %H:%M:%S'
         )
 
-        # Create and configure file handler
-        file_handler = logging.FileHandler(self._log_file, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(file_formatter)
+        # Shared file handler, rotated into compressed segments
+        file_handler = self._create_file_handler()
 
         # Create and configure console handler
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(file_formatter)
 
-        # Add handlers to logger
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        # Stop the background writer of a previous configuration
+        listener = Logger._listeners.pop(self._name, None)
+        if listener is not None:
+            listener.stop()
+
+        if self._queued:
+            # The logging thread only enqueues, a background thread formats and writes the records
+            records = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+            listener.start()
+            Logger._listeners[self._name] = listener
+            self.logger.addHandler(logging.handlers.QueueHandler(records))
+        else:
+            # Add handlers to logger
+            self.logger.addHandler(file_handler)
+            self.logger.addHandler(console_handler)
 
         self._configured = True
 
+    def flush(self):
+        """Wait until the queued records are written"""
+        listener = Logger._listeners.get(self._name)
+        if listener is not None:
+            # Stopping drains the queue, the listener is restarted for the next records
+            listener.stop()
+            listener.start()
+
     def info(self, message):
         """Log message with UTF-8 handling"""
         try:
@@ -243,29 +336,58 @@ class Logger:
         except Exception as e:
             self.logger.error(f"Error logging warning message: {str(e)}")
 
-    def handle_logs(self, action: str = 'read'):
-        """Handle logs operations with UTF-8 handling"""
+    def handle_logs(self, action: str = 'read', limit=None):
+        """
+        Handle logs operations with UTF-8 handling
+
+        Parameters:
+        action (str): 'read' or 'clear'
+        limit (int): Number of most recent records read, read from the end of the file (default: all)
+        """
         try:
             if action == 'read':
-                with open(self._log_file, 'r', encoding='utf-8') as f:
-                    log_content = f.read()
+                if limit is not None:
+                    log_content = '\n'.join(record.text for record in tail(self._log_file, limit))
+                else:
+                    # Active file and archived segments, oldest first
+                    log_content = '\n'.join(reversed(list(read_log_lines_reversed(self._log_file))))
                 if log_content:
                     return log_content
                 return "No logs found"
             elif action == 'clear':
-                with open(self._log_file, 'w', encoding='utf-8') as f:
-                    f.write('')
+                self._clear_segments()
                 return "Logs cleared successfully"
         except FileNotFoundError:
             return "No logs found"
         except Exception as e:
             return f"Failed to {action} logs: {str(e)}"
 
+    def query_logs(self, log_filter=None, tail_count=None, page=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Return the log records matching a LogFilter, streaming through the log and its segments.
+
+        Parameters:
+        log_filter (LogFilter): Filter of the records (default: every record)
+        tail_count (int): Only the last tail_count matching records
+        page (int): Only the page-th (1-based) page of page_size matching records
+        """
+        try:
+            return query_records(self._log_file, log_filter, tail_count, page, page_size)
+        except Exception as e:
+            self.error(f"Error reading logs: {str(e)}")
+            return []
+
+    def _clear_segments(self):
+        """Empty the active log file and delete its archived segments"""
+        with open(self._log_file, 'w', encoding='utf-8') as f:
+            f.write('')
+        for segment in log_segments(self._log_file)[1:]:
+            os.remove(segment)
+
     def clear_logs(self):
         """Clear all logs with UTF-8 handling"""
         try:
-            with open(self._log_file, 'w', encoding='utf-8') as f:
-                f.write('')
+            self._clear_segments()
             return True
         except Exception as e:
             self.error(f"Error clearing logs: {str(e)}")